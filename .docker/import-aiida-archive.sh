@@ -6,6 +6,7 @@
 # Debugging.
 set -x
 
-if [ -f "/tmp/mount_folder/archive.aiida" ]; then
-    verdi import --non-interactive --migration /tmp/mount_folder/archive.aiida
-fi
+# Archives that were already imported are skipped, see the docstring of the script. A fresh container restores the
+# storage from the snapshot that the first container saved after importing the archives.
+python /opt/import_aiida_archive.py --snapshot-dir /opt/aiida-snapshot \
+    /opt/tutorial-archives /tmp/mount_folder/archive.aiida
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import AiiDA archives into the current profile, skipping archives that were already imported.
+
+This script is executed whenever the docker container is (re)started, after the AiiDA profile has been set up.
+
+Every archive is fingerprinted by its SHA256 checksum, which is only recomputed when the size or modification time of
+the file changed. The progress of every archive is recorded in a state file per profile:
+
+- `migrated`: the archive was migrated to the latest archive version, and the migrated copy is kept in the cache
+  directory until the import finished, so an interrupted import does not migrate the archive again;
+- `imported`: the archive was imported in batches of `--batch-size` rows, and the import group was created;
+- `skipped`: all nodes and groups of the archive were already in the database, so it was not imported.
+
+An archive is skipped if it was imported and its import group still exists. Since the import skips the nodes that
+are already in the database, rerunning an interrupted import only writes the missing nodes.
+
+Directories of archives and manifests can be passed to import a whole dataset. The archives are then migrated and
+parsed in parallel by `--processes` worker processes, while this process writes them to the database one by one.
+
+With `--snapshot-dir`, the database and repository are saved to a snapshot after new archives were imported, and
+restored from it on a fresh container whose storage is still empty, which is much faster than importing. With
+`--migrate-only`, e.g. when the docker image is built, the archives are only migrated to the latest archive version
+into a directory, so that the containers do not have to migrate them.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+DEFAULT_ARCHIVE = "/tmp/mount_folder/archive.aiida"
+DEFAULT_STATE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "aiida-tutorials", "archives"
+)
+
+
+def get_fingerprint(path, previous=None):
+    """Return the fingerprint of an archive, reusing the checksum of the previous fingerprint if the file is unchanged.
+
+    :param previous: the fingerprint recorded for the archive in a previous run
+    :return: dictionary with the size, modification time and SHA256 checksum of the file
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(key) == fingerprint[key] for key in fingerprint):
+        fingerprint["sha256"] = previous["sha256"]
+        return fingerprint
+
+    checksum = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            checksum.update(chunk)
+    fingerprint["sha256"] = checksum.hexdigest()
+    return fingerprint
+
+
+def load_state(state_file):
+    """Return the recorded state of all archives, by absolute path."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def save_state(state_file, state):
+    """Write the state of all archives atomically, so an interrupted write does not corrupt it."""
+    directory = os.path.dirname(state_file)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, delete=False, encoding="utf-8"
+    ) as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(handle.name, state_file)
+
+
+def migrate_archive(path, sha256, cache_dir):
+    """Return the path of a copy of the archive at the latest version, migrating it if needed.
+
+    The migrated copy is stored in the cache directory under the checksum of the original archive.
+    """
+    from aiida.tools.archive.abstract import get_format
+
+    archive_format = get_format()
+    if archive_format.read_version(path) == archive_format.latest_version:
+        return path
+
+    migrated = os.path.join(cache_dir, "{}.aiida".format(sha256))
+    if not os.path.exists(migrated):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Other workers can migrate a copy of the same archive at the same time
+        partial = "{}.{}.partial".format(migrated, os.getpid())
+        archive_format.migrate(path, partial, archive_format.latest_version, force=True)
+        os.replace(partial, migrated)
+    return migrated
+
+
+def copy_tree(source, target):
+    """Replace the directory `target` with a copy of `source`, using copy-on-write clones where supported."""
+    shutil.rmtree(target, ignore_errors=True)
+    try:
+        subprocess.run(["cp", "-a", "--reflink=auto", source, target], check=True)
+    except (OSError, subprocess.CalledProcessError):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target, symlinks=True)
+
+
+def get_storage_paths(profile):
+    """Return the directory with the files of the storage of a profile, and the database that is stored separately.
+
+    :return: tuple of the directory and the storage configuration of the PostgreSQL database, or `None` if the
+        database is a file in the directory
+    """
+    config = profile.storage_config
+    if profile.storage_backend == "core.psql_dos":
+        return urlparse(config["repository_uri"]).path, config
+    if profile.storage_backend == "core.sqlite_dos":
+        return config["filepath"], None
+    raise ValueError(
+        "Snapshots are not supported for the storage backend {}".format(
+            profile.storage_backend
+        )
+    )
+
+
+def run_postgres_command(command, config, *args):
+    """Run `pg_dump` or `pg_restore` with the connection parameters of a storage configuration."""
+    subprocess.run(
+        [
+            command,
+            "--host",
+            config["database_hostname"],
+            "--port",
+            str(config["database_port"]),
+            "--username",
+            config["database_username"],
+            *args,
+        ],
+        env=dict(os.environ, PGPASSWORD=config["database_password"]),
+        check=True,
+    )
+
+
+def save_snapshot(profile, snapshot_dir, state):
+    """Save the database and repository of the profile, and the state of the imported archives, to a snapshot.
+
+    The snapshot is written next to the previous one and only replaces it once it is complete.
+    """
+    from aiida.manage import get_manager
+
+    directory, database = get_storage_paths(profile)
+    partial = tempfile.mkdtemp(dir=snapshot_dir, prefix="partial-")
+
+    # Close the connections, so that the files and the database are consistent
+    get_manager().reset_profile_storage()
+    if database is not None:
+        run_postgres_command(
+            "pg_dump",
+            database,
+            "--format=custom",
+            "--file",
+            os.path.join(partial, "database.dump"),
+            database["database_name"],
+        )
+    copy_tree(directory, os.path.join(partial, "storage"))
+    with open(os.path.join(partial, "manifest.json"), "w", encoding="utf-8") as handle:
+        json.dump(
+            {"storage_backend": profile.storage_backend, "archives": state}, handle
+        )
+
+    current = os.path.join(snapshot_dir, "current")
+    shutil.rmtree(current, ignore_errors=True)
+    os.replace(partial, current)
+    print("Saved snapshot of profile {} to {}".format(profile.name, current))
+
+
+def restore_snapshot(profile, snapshot_dir):
+    """Restore the database and repository of the profile from a snapshot, if its storage is still empty.
+
+    :return: the state of the archives in the snapshot, or `None` if nothing was restored
+    """
+    from aiida.manage import get_manager
+    from aiida.orm import Node, QueryBuilder
+
+    current = os.path.join(snapshot_dir, "current")
+    manifest_file = os.path.join(current, "manifest.json")
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, encoding="utf-8") as handle:
+        manifest = json.load(handle)
+    if manifest["storage_backend"] != profile.storage_backend:
+        return None
+    if QueryBuilder().append(Node).count():
+        return None
+
+    directory, database = get_storage_paths(profile)
+    get_manager().reset_profile_storage()
+    if database is not None:
+        run_postgres_command(
+            "pg_restore",
+            database,
+            "--clean",
+            "--if-exists",
+            "--no-owner",
+            "--dbname",
+            database["database_name"],
+            os.path.join(current, "database.dump"),
+        )
+    copy_tree(os.path.join(current, "storage"), directory)
+    print("Restored profile {} from snapshot {}".format(profile.name, current))
+    return manifest["archives"]
+
+
+def fetch(source):
+    """Return the path of an archive, downloading it through the cache of `fetch_archive.py` if it is a URL."""
+    if not urlparse(source).scheme:
+        return source
+    from fetch_archive import fetch_archive
+
+    return fetch_archive(source)
+
+
+def migrate_to_directory(source, output_dir):
+    """Fetch the archive if it is a URL and write it at the latest archive version to the output directory."""
+    os.makedirs(output_dir, exist_ok=True)
+    target = os.path.join(output_dir, os.path.basename(urlparse(source).path))
+    path = fetch(source)
+
+    migrated = migrate_archive(path, os.path.basename(target), output_dir)
+    if migrated == path:
+        shutil.copyfile(path, target)
+    else:
+        os.replace(migrated, target)
+    print("Migrated {} to {}".format(source, target))
+
+
+def expand_archives(sources):
+    """Return the paths of the archives, expanding directories and manifests.
+
+    :param sources: paths or URLs of archives, paths of directories whose `*.aiida` files are imported, or of
+        manifests, i.e. `.txt` files with the path or URL of an archive on every line, where paths are relative to the
+        manifest and `#` starts a comment
+    """
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, "*.aiida"))))
+        elif source.endswith(".txt") and os.path.isfile(source):
+            with open(source, encoding="utf-8") as handle:
+                lines = [line.split("#", 1)[0].strip() for line in handle]
+            directory = os.path.dirname(source)
+            paths.extend(
+                fetch(line if urlparse(line).scheme else os.path.join(directory, line))
+                for line in lines
+                if line
+            )
+        else:
+            paths.append(fetch(source))
+    # Keep the first occurrence of archives that are listed more than once
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def is_imported(record):
+    """Return whether the archive of a state record was imported and its import group still exists.
+
+    Archives that were skipped because all their nodes and groups were already in the database count as imported.
+    """
+    from aiida.common.exceptions import NotExistent
+    from aiida.orm import Group
+
+    if record.get("stage") == "skipped":
+        return True
+    if record.get("stage") != "imported":
+        return False
+    try:
+        Group.collection.get(uuid=record["group"])
+    except NotExistent:
+        return False
+    return True
+
+
+def prepare_archive(path, previous, cache_dir):
+    """Fingerprint and migrate an archive and read the UUIDs of its nodes and groups.
+
+    This is run in the worker processes, which do not load a profile.
+
+    :param previous: the fingerprint recorded for the archive in a previous run
+    :return: tuple of the fingerprint, the path of the migrated archive and the set of UUIDs
+    """
+    from aiida.orm import Group, Node
+    from aiida.tools.archive.abstract import get_format
+
+    fingerprint = get_fingerprint(path, previous)
+    migrated = migrate_archive(path, fingerprint["sha256"], cache_dir)
+    uuids = set()
+    with get_format().open(migrated, "r") as reader:
+        for entity in (Node, Group):
+            uuids.update(
+                reader.querybuilder().append(entity, project="uuid").all(flat=True)
+            )
+    return fingerprint, migrated, uuids
+
+
+def get_existing_uuids(uuids, chunk_size=10000):
+    """Return the subset of the UUIDs of nodes and groups that are already in the database."""
+    from aiida.orm import Group, Node, QueryBuilder
+
+    uuids = list(uuids)
+    existing = set()
+    for index in range(0, len(uuids), chunk_size):
+        chunk = uuids[index : index + chunk_size]
+        for entity in (Node, Group):
+            query = QueryBuilder().append(
+                entity, filters={"uuid": {"in": chunk}}, project="uuid"
+            )
+            existing.update(query.all(flat=True))
+    return existing
+
+
+def import_archives(paths, state, state_file, cache_dir, batch_size, processes=None):
+    """Import the archives that were not imported yet, recording the progress in the state.
+
+    The archives are fingerprinted, migrated and parsed in parallel worker processes, and written to the database by
+    this process as soon as they are ready, one at a time, so the import itself is a single bulk writer. Before an
+    archive is written, its UUIDs are compared with those in the database and in the archives written before:
+    archives without new nodes or groups, e.g. subsets of other archives or copies with the same content, are not
+    imported at all.
+
+    :param processes: number of worker processes, by default the number of CPUs
+    :return: whether any archive was imported
+    """
+    from aiida.orm import Group
+    from aiida.tools.archive import import_archive
+
+    migrated_dir = os.path.join(cache_dir, "migrated")
+    written = set()
+    imported = False
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {}
+        for path in paths:
+            record = state.get(path, {})
+            # Skip unchanged archives without hashing them again
+            fingerprint = record.get("fingerprint")
+            if fingerprint and is_imported(record):
+                stat = os.stat(path)
+                if (stat.st_size, stat.st_mtime_ns) == (
+                    fingerprint["size"],
+                    fingerprint["mtime_ns"],
+                ):
+                    print("Skipping {}: already imported".format(path))
+                    continue
+            future = executor.submit(prepare_archive, path, fingerprint, migrated_dir)
+            futures[future] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            fingerprint, migrated, uuids = future.result()
+            previous = state.get(path, {})
+            if previous.get("fingerprint", {}).get("sha256") != fingerprint["sha256"]:
+                previous = {}
+            record = state[path] = dict(previous, fingerprint=fingerprint)
+
+            if is_imported(record):
+                print("Skipping {}: already imported".format(path))
+                new = set()
+            else:
+                new = uuids - written
+                new -= get_existing_uuids(new)
+                if not new:
+                    record["stage"] = "skipped"
+                    print(
+                        "Skipping {}: all nodes and groups already imported".format(
+                            path
+                        )
+                    )
+
+            if new:
+                print(
+                    "Importing {} ({} of {} nodes and groups are new)".format(
+                        path, len(new), len(uuids)
+                    )
+                )
+                record["stage"] = "migrated"
+                save_state(state_file, state)
+                group = Group.collection.get(
+                    id=import_archive(migrated, batch_size=batch_size)
+                )
+                record.update(stage="imported", group=group.uuid)
+                imported = True
+                print("Imported {} into group {}".format(path, group.label))
+            written |= uuids
+            save_state(state_file, state)
+
+            # The migrated copy is no longer needed and can be as large as the archive
+            if migrated != path and os.path.exists(migrated):
+                os.remove(migrated)
+
+    return imported
+
+
+def main(argv=None):
+    """Import the archives given on the command line."""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "archives",
+        nargs="*",
+        default=[DEFAULT_ARCHIVE],
+        help="archives, which can also be URLs, directories of archives or `.txt` manifests listing archives",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of database rows that are streamed from the archive at once",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=os.environ.get("AIIDA_ARCHIVE_STATE_DIR", DEFAULT_STATE_DIR),
+        help="directory of the state file and the migrated archives",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="number of processes that migrate and parse the archives, by default the number of CPUs",
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        help="directory of the snapshot to restore the storage from, and to save it to after importing",
+    )
+    parser.add_argument(
+        "--migrate-only",
+        metavar="OUTPUT_DIR",
+        help="only migrate the archives into this directory, without a profile",
+    )
+    args = parser.parse_args(argv)
+
+    if args.migrate_only:
+        for source in args.archives:
+            migrate_to_directory(source, args.migrate_only)
+        return
+
+    from aiida import load_profile
+
+    profile = load_profile()
+    state_file = os.path.join(args.state_dir, "{}.json".format(profile.name))
+    state = load_state(state_file)
+
+    restored = None
+    if args.snapshot_dir:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+        restored = restore_snapshot(profile, args.snapshot_dir)
+        if restored is not None:
+            state.update(restored)
+            save_state(state_file, state)
+
+    paths = []
+    for path in expand_archives(args.archives):
+        if os.path.isfile(path):
+            paths.append(path)
+        else:
+            print("Skipping {}: file not found".format(path))
+    imported = import_archives(
+        paths, state, state_file, args.state_dir, args.batch_size, args.processes
+    )
+
+    if args.snapshot_dir and imported:
+        save_snapshot(profile, args.snapshot_dir, state)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,8 +12,11 @@
 # serve to show the default.
 # pylint: disable=invalid-name
 import os
-import subprocess
 import pathlib
+import sys
+
+# Local extensions, e.g. to generate the tutorial and solution versions of the notebook templates
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "scripts"))
 
 # -- General configuration -----------------------------------------------------
 
@@ -42,6 +45,7 @@ extensions = [
     "sphinx_copybutton",
     "sphinx_panels",
     "sphinx_tabs.tabs",
+    "template_notebooks",
 ]
 
 myst_enable_extensions = [
@@ -123,6 +127,9 @@ exclude_patterns = [
     "**/.ipynb_checkpoints/",
     "**/clipboard.md",
     "sections/managing_data/querying.md",
+    # The tutorial and solution versions are generated from these by the `template_notebooks` extension
+    "**/*-template.ipynb",
+    "**/*-template.md",
 ]
 exclude_patterns.append("sections/running_processes/reference.md")
 
@@ -404,12 +411,3 @@ intersphinx_mapping = {
     "aiida": ("https://aiida.readthedocs.io/projects/aiida-core/en/latest/", None),
     "plumpy": ("https://plumpy.readthedocs.io/en/latest/", None),
 }
-
-# Compile all things needed before building the docs
-# For instance, convert the notebook templates to actual tutorial and solution versions
-print(
-    subprocess.check_output(
-        ["make", "-C", os.path.dirname(os.path.realpath(__file__)), "pre-docs"],
-        universal_newlines=True,
-    )
-)
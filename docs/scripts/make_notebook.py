@@ -1,40 +1,190 @@
 #!/usr/bin/env python
 """Prepare teaching + solution version of querybuilder notebook"""
 # pylint: disable=invalid-name
-import copy
+import contextlib
+import hashlib
 import json
+import os
 import sys
+import time
 
+# Manifest with the hashes of the templates that produced the current outputs
+DEFAULT_MANIFEST = os.path.join("build", "notebooks-manifest.json")
 
-def remove_lines_from_cell(cell, remove_from_string, remove_to_string, remove_string):
-    """remove lines from cell of notebook"""
-    indices_to_remove = set()
-    first_line_solution = None
-    last_line_solution = None
-    for idx, line in enumerate(cell["source"]):
-        if line.startswith(remove_string):
-            indices_to_remove.add(idx)
-        elif line.startswith(remove_from_string):
-            if first_line_solution is not None:
-                raise Exception("I only support the removal of one block per cell")
-            first_line_solution = idx
-        elif line.startswith(remove_to_string):
-            if first_line_solution is None:
-                raise Exception("I have no line for starting this block")
-            last_line_solution = idx
-    if first_line_solution is not None:
-        if last_line_solution is None:
-            raise Exception("I found a start for the block but no end of the block")
-        indices_to_remove |= set(range(first_line_solution, last_line_solution + 1))
-
-    for idx in sorted(indices_to_remove, reverse=True):
-        cell["source"].pop(idx)
+
+class TemplateError(Exception):
+    """Raised when the ``#TUT_*`` markers of a template are not balanced, listing every problem that was found."""
+
+
+def split_lines(lines, location="Line {}"):
+    """Classify each line of a template once, yielding its tutorial and its solution version.
+
+    The tutorial drops the blocks between ``#TUT_SOLUTION_START`` and ``#TUT_SOLUTION_END`` and all ``#TUT_USER``
+    lines, the solution drops the blocks between ``#TUT_USER_START`` and ``#TUT_USER_END`` and all ``#TUT_SOLUTION``
+    lines. Any number of consecutive or nested blocks is supported. Lines are consumed lazily, and the unbalanced
+    markers are reported all together once the lines are exhausted.
+
+    :param lines: iterable of lines, e.g. an open file
+    :param location: format string for the position of a line in the error messages
+    :return: generator of ``(tutorial line, solution line)`` tuples, where a dropped line is ``None``
+    :raises TemplateError: if the markers are not balanced
+    """
+    errors = []
+    # Stack of the (kind, line number) of the open blocks
+    blocks = []
+    depth = {"#TUT_SOLUTION": 0, "#TUT_USER": 0}
+    for number, line in enumerate(lines, 1):
+        marker = False
+        for kind in depth:
+            if line.startswith(kind + "_START"):
+                blocks.append((kind, number))
+                depth[kind] += 1
+                marker = True
+            elif line.startswith(kind + "_END"):
+                marker = True
+                if not depth[kind]:
+                    errors.append(
+                        (location + ": {}_END without a matching {}_START").format(
+                            number, kind, kind
+                        )
+                    )
+                    continue
+                if blocks[-1][0] != kind:
+                    errors.append(
+                        (
+                            location + ": {}_END inside the block opened on line {}"
+                        ).format(number, kind, blocks[-1][1])
+                    )
+                # Close the innermost block of this kind
+                index = max(i for i, block in enumerate(blocks) if block[0] == kind)
+                del blocks[index]
+                depth[kind] -= 1
+
+        tutorial_line = solution_line = None
+        if (
+            not marker
+            and not depth["#TUT_SOLUTION"]
+            and not line.startswith("#TUT_USER")
+        ):
+            tutorial_line = line
+        if (
+            not marker
+            and not depth["#TUT_USER"]
+            and not line.startswith("#TUT_SOLUTION")
+        ):
+            solution_line = line
+        yield tutorial_line, solution_line
+
+    for kind, number in blocks:
+        errors.append(
+            (location + ": {}_START without a matching {}_END").format(
+                number, kind, kind
+            )
+        )
+    if errors:
+        raise TemplateError("\n".join(errors))
+
+
+def split_source(source, location="Line {}"):
+    """Split the source lines of a notebook cell into its tutorial and solution version.
+
+    :return: tuple with the tutorial and the solution source lines
+    """
+    tutorial_source = []
+    solution_source = []
+    for tutorial_line, solution_line in split_lines(source, location):
+        if tutorial_line is not None:
+            tutorial_source.append(tutorial_line)
+        if solution_line is not None:
+            solution_source.append(solution_line)
+    return tutorial_source, solution_source
+
+
+@contextlib.contextmanager
+def remove_on_error(*file_names):
+    """Remove the (partially written) output files if an exception is raised."""
+    try:
+        yield
+    except BaseException:
+        for file_name in file_names:
+            if file_name is not None and os.path.exists(file_name):
+                os.remove(file_name)
+        raise
+
+
+class NotebookWriter:
+    """Write a notebook to a file one cell at a time, with the same output as ``json.dump``.
+
+    All top-level entries other than ``cells`` are taken from the template.
+    """
+
+    def __init__(self, handle, template, indent=None, sort_keys=False):
+        self.handle = handle
+        self.template = template
+        self.indent = indent
+        self.sort_keys = sort_keys
+        # ``json.dump`` drops the space after the item separator when indenting
+        self.item_separator = ", " if indent is None else ","
+        self.num_cells = 0
+        keys = sorted(template) if sort_keys else list(template)
+        position = keys.index("cells")
+        self.head_keys = keys[:position]
+        self.tail_keys = keys[position + 1 :]
+
+    def _newline(self, depth):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * depth)
+
+    def _dumps(self, obj, depth):
+        text = json.dumps(
+            obj,
+            indent=self.indent,
+            sort_keys=self.sort_keys,
+            separators=(self.item_separator, ": "),
+        )
+        return text.replace("\n", self._newline(depth))
+
+    def _write_entry(self, key):
+        self.handle.write(
+            "{}{}: {}".format(
+                self._newline(1), json.dumps(key), self._dumps(self.template[key], 1)
+            )
+        )
+
+    def begin(self):
+        """Write everything up to the first cell."""
+        self.handle.write("{")
+        for key in self.head_keys:
+            self._write_entry(key)
+            self.handle.write(self.item_separator)
+        self.handle.write('{}"cells": ['.format(self._newline(1)))
+
+    def write_cell(self, cell):
+        """Write the next cell."""
+        if self.num_cells:
+            self.handle.write(self.item_separator)
+        self.handle.write(self._newline(2) + self._dumps(cell, 2))
+        self.num_cells += 1
+
+    def end(self):
+        """Write everything after the last cell."""
+        if self.num_cells:
+            self.handle.write(self._newline(1))
+        self.handle.write("]")
+        for key in self.tail_keys:
+            self.handle.write(self.item_separator)
+            self._write_entry(key)
+        self.handle.write(self._newline(0) + "}")
 
 
 def make_notebook(template_file_name, tutorial_file_name=None, solution_file_name=None):
     """
     Master function to create requested notebooks
 
+    Both versions are written in a single pass over the cells of the template. The cells of the outputs only get a
+    new ``source`` and share everything else (e.g. outputs and attachments) with the template, so no copy of the
+    notebook is made.
     """
     if tutorial_file_name is None and solution_file_name is None:
         print("Nothing to do")
@@ -43,28 +193,49 @@ def make_notebook(template_file_name, tutorial_file_name=None, solution_file_nam
     with open(template_file_name) as f:
         template = json.load(f)
 
-    if tutorial_file_name is not None:
-        tutorial = copy.deepcopy(template)
-        for cell in tutorial["cells"]:
-            remove_lines_from_cell(
-                cell, "#TUT_SOLUTION_START", "#TUT_SOLUTION_END", "#TUT_USER"
+    with remove_on_error(
+        tutorial_file_name, solution_file_name
+    ), contextlib.ExitStack() as stack:
+        writers = []
+        if tutorial_file_name is not None:
+            tutorial = NotebookWriter(
+                stack.enter_context(open(tutorial_file_name, "w")), template
             )
-        with open(tutorial_file_name, "w") as f:
-            json.dump(tutorial, f)
-
-    if solution_file_name is not None:
-        solution = copy.deepcopy(template)
-        for cell in solution["cells"]:
-            remove_lines_from_cell(
-                cell, "#TUT_USER_START", "#TUT_USER_END", "#TUT_SOLUTION"
+            writers.append((0, tutorial))
+        if solution_file_name is not None:
+            solution = NotebookWriter(
+                stack.enter_context(open(solution_file_name, "w")),
+                template,
+                indent=1,
+                sort_keys=True,
             )
-        with open(solution_file_name, "w") as f:
-            json.dump(solution, f, indent=1, sort_keys=True, separators=(",", ": "))
+            writers.append((1, solution))
+
+        for _, writer in writers:
+            writer.begin()
+        errors = []
+        for index, cell in enumerate(template["cells"]):
+            try:
+                sources = split_source(
+                    cell["source"], "Cell {} line {{}}".format(index)
+                )
+            except TemplateError as exception:
+                errors.append(str(exception))
+                continue
+            for output, writer in writers:
+                writer.write_cell(dict(cell, source=sources[output]))
+        if errors:
+            raise TemplateError("\n".join(errors))
+        for _, writer in writers:
+            writer.end()
 
 
 def make_markdown(template_file_name, tutorial_file_name=None, solution_file_name=None):
-    """Master function to create requested notebooks, in markdown format."""
-    # pylint: disable=too-many-branches
+    """Master function to create requested notebooks, in markdown format.
+
+    The template is read line by line and the tutorial is written as it goes; the solution has to be converted to a
+    notebook as a whole, so only its lines are kept in memory.
+    """
     from jupytext.myst import myst_to_notebook
     import nbformat
 
@@ -72,60 +243,133 @@ def make_markdown(template_file_name, tutorial_file_name=None, solution_file_nam
         print("Nothing to do")
         return
 
-    with open(template_file_name) as f:
-        template = f.readlines()
-
-    if tutorial_file_name is not None:
-        in_solution = False
-        tutorial_lines = []
-        for i, line in enumerate(template):
-            if line.startswith("#TUT_SOLUTION_START"):
-                in_solution = True
-            elif line.startswith("#TUT_SOLUTION_END"):
-                in_solution = False
-            elif line.startswith("#TUT_USER"):
-                if in_solution:
-                    raise Exception(
-                        "Line {}: In solution, but found user end/start".format(i)
-                    )
-            elif not in_solution:
-                tutorial_lines.append(line)
-        with open(tutorial_file_name, "w") as f:
-            f.writelines(tutorial_lines)
-
-    if solution_file_name is not None:
-        in_tutorial = False
-        solution_lines = []
-        for i, line in enumerate(template):
-            if line.startswith("#TUT_USER_START"):
-                in_tutorial = True
-            elif line.startswith("#TUT_USER_END"):
-                in_tutorial = False
-            elif line.startswith("#TUT_SOLUTION"):
-                if in_tutorial:
-                    raise Exception(
-                        "Line {}: In tutorial, but found solution end/start".format(i)
-                    )
-            elif not in_tutorial:
-                solution_lines.append(line)
-        # for the solution, since we are not going to parse it in sphinx,
-        # we just convert it straight to a notebook
-        notebook = myst_to_notebook("".join(solution_lines))
-        with open(solution_file_name, "w") as f:
+    solution_lines = []
+    with remove_on_error(tutorial_file_name, solution_file_name), open(
+        template_file_name
+    ) as template, contextlib.ExitStack() as stack:
+        tutorial = None
+        if tutorial_file_name is not None:
+            tutorial = stack.enter_context(open(tutorial_file_name, "w"))
+        for tutorial_line, solution_line in split_lines(template):
+            if tutorial is not None and tutorial_line is not None:
+                tutorial.write(tutorial_line)
+            if solution_file_name is not None and solution_line is not None:
+                solution_lines.append(solution_line)
+
+        if solution_file_name is not None:
+            # for the solution, since we are not going to parse it in sphinx,
+            # we just convert it straight to a notebook
+            notebook = myst_to_notebook("".join(solution_lines))
             nbformat.write(notebook, solution_file_name)
 
 
+def get_outputs(template_file_name):
+    """Return the function and the output files for a template, following the naming conventions of the Makefile.
+
+    :return: tuple ``(function name, tutorial file name, solution file name)``
+    """
+    if template_file_name.endswith("-template.ipynb"):
+        stem = template_file_name[: -len("-template.ipynb")]
+        return "make_notebook", stem + "-tutorial.ipynb", stem + "-solutions.ipynb"
+    if template_file_name.endswith("-template.md"):
+        stem = template_file_name[: -len("-template.md")]
+        return "make_markdown", stem + "-tutorial.md", stem + "-solutions.ipynb"
+    if template_file_name.endswith(".md"):
+        return "make_markdown", None, template_file_name[: -len(".md")] + ".ipynb"
+    raise ValueError("Unknown template type: {}".format(template_file_name))
+
+
+def get_template_hash(template_file_name):
+    """Hash the template content together with this script, so that changes to either invalidate the outputs."""
+    digest = hashlib.sha256()
+    for file_name in (__file__, template_file_name):
+        with open(file_name, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _run_job(job):
+    """Generate the outputs of a single template, returning the time it took (run in a worker process)."""
+    func_name, template_file_name, tutorial_file_name, solution_file_name = job
+    start = time.perf_counter()
+    globals()[func_name](
+        template_file_name=template_file_name,
+        tutorial_file_name=tutorial_file_name,
+        solution_file_name=solution_file_name,
+    )
+    return time.perf_counter() - start
+
+
+def make_all(template_file_names, manifest_file_name=DEFAULT_MANIFEST, processes=None):
+    """Generate the outputs of many templates, skipping those whose template did not change since the last run.
+
+    Stale templates are processed in parallel on a process pool; a single stale template is processed in this
+    process, to avoid paying for the start-up of the pool.
+
+    :param template_file_names: the templates to process
+    :param manifest_file_name: JSON file recording the template hash of each output
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :return: dictionary with the time in seconds spent on each template that was (re)generated
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        with open(manifest_file_name) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    jobs = []
+    hashes = {}
+    for template_file_name in template_file_names:
+        func_name, tutorial_file_name, solution_file_name = get_outputs(
+            template_file_name
+        )
+        outputs = [name for name in (tutorial_file_name, solution_file_name) if name]
+        hashes[template_file_name] = get_template_hash(template_file_name)
+        if all(
+            manifest.get(name) == hashes[template_file_name] and os.path.exists(name)
+            for name in outputs
+        ):
+            continue
+        jobs.append(
+            (func_name, template_file_name, tutorial_file_name, solution_file_name)
+        )
+
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            timings = list(executor.map(_run_job, jobs))
+    else:
+        timings = [_run_job(job) for job in jobs]
+
+    for job in jobs:
+        for name in job[2:]:
+            if name:
+                manifest[name] = hashes[job[1]]
+
+    if jobs:
+        if os.path.dirname(manifest_file_name):
+            os.makedirs(os.path.dirname(manifest_file_name), exist_ok=True)
+        with open(manifest_file_name, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    return {job[1]: timing for job, timing in zip(jobs, timings)}
+
+
 if __name__ == "__main__":
     from argparse import ArgumentParser
 
     parser = ArgumentParser(
         "To make the user version and a solution version:"
         + "\npython make_notebook.py template.ipynb -t tutorial.ipynb -s solution.ipynb"
+        + "\nTo process many templates, deriving the output file names from the template names:"
+        + "\npython make_notebook.py --batch first-template.ipynb second-template.md ..."
     )
     parser.add_argument(
         "template",
         help="Provide the template the contains both versions, tutorial and solution",
         type=str,
+        nargs="+",
     )
     parser.add_argument(
         "-t",
@@ -139,14 +383,45 @@ if __name__ == "__main__":
     parser.add_argument(
         "-m", "--markdown", action="store_true", help="Parse as markdown file"
     )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="Process all templates in parallel, skipping those that did not change since the last run",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes in batch mode (default: number of CPUs)",
+        type=int,
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Manifest of the template hashes used in batch mode",
+        type=str,
+        default=DEFAULT_MANIFEST,
+    )
     pa = parser.parse_args(sys.argv[1:])
 
+    if pa.batch:
+        timings = make_all(
+            pa.template, manifest_file_name=pa.manifest, processes=pa.jobs
+        )
+        for template_name, timing in timings.items():
+            print(
+                "Generated notebooks from {} in {:.2f}s".format(template_name, timing)
+            )
+        sys.exit(0)
+
+    if len(pa.template) > 1:
+        parser.error("Only one template can be given, unless --batch is used")
+
     func = make_notebook
     if pa.markdown:
         func = make_markdown
 
     func(
-        template_file_name=pa.template,
+        template_file_name=pa.template[0],
         tutorial_file_name=pa.tutorial,
         solution_file_name=pa.solution,
     )
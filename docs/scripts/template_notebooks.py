@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Sphinx extension that generates the tutorial and solution versions of the notebook templates.
+
+The outputs of each template are derived with :func:`make_notebook.get_outputs`, and only those whose template
+changed since the last build (or that are missing) are regenerated, before Sphinx reads the sources.
+"""
+import glob
+import os
+
+from sphinx.util import logging
+
+import make_notebook
+
+LOGGER = logging.getLogger(__name__)
+
+
+def generate_notebooks(app):
+    """Regenerate the stale outputs of the notebook templates, reporting the time spent on each."""
+    if app.builder.name in app.config.notebook_templates_skip_builders:
+        return
+
+    templates = sorted(
+        {
+            path
+            for pattern in app.config.notebook_templates
+            for path in glob.glob(os.path.join(app.srcdir, pattern))
+        }
+    )
+    timings = make_notebook.make_all(
+        templates,
+        manifest_file_name=os.path.join(app.doctreedir, "notebooks-manifest.json"),
+    )
+
+    for template, timing in timings.items():
+        outputs = [
+            os.path.relpath(name, app.srcdir)
+            for name in make_notebook.get_outputs(template)[1:]
+            if name
+        ]
+        LOGGER.info(
+            "regenerated %s from %s in %.2fs",
+            ", ".join(outputs),
+            os.path.relpath(template, app.srcdir),
+            timing,
+        )
+    LOGGER.info(
+        "notebook templates: %d of %d regenerated", len(timings), len(templates)
+    )
+
+
+def setup(app):
+    """Setup function called by sphinx."""
+    app.add_config_value(
+        "notebook_templates",
+        [
+            "sections/*/*-template.ipynb",
+            "sections/*/*-template.md",
+            "sections/*/bandstructure.md",
+        ],
+        "env",
+    )
+    app.add_config_value("notebook_templates_skip_builders", ["linkcheck"], "env")
+    app.connect("builder-inited", generate_notebooks)
+    return {"parallel_read_safe": True}
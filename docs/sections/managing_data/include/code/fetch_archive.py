@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Fetch the archives of the tutorial through a local cache, so the same archive is never downloaded twice.
+
+The downloaded archives are stored in a content-addressed cache directory, under their SHA256 checksum, together with
+an index of the URLs they were downloaded from. The archives are only verified if their expected checksum is passed,
+when they are downloaded: archives that are already in the cache are not checked again. The least recently used
+archives are removed when the cache grows larger than its maximum size. The behaviour can be configured with
+environment variables:
+
+- `AIIDA_ARCHIVE_URL`: the URL that archive names are relative to, e.g. of a local mirror, ending with a slash;
+- `AIIDA_ARCHIVE_CACHE`: the cache directory, by default `~/.cache/aiida-tutorials/downloads`;
+- `AIIDA_ARCHIVE_CACHE_SIZE`: the maximum size of the cache in bytes, by default 5 GB;
+- `AIIDA_ARCHIVE_OFFLINE`: if set to `1`, only archives that are already in the cache are returned.
+
+Run e.g. ``verdi archive import $(python fetch_archive.py aiida_tutorial_2022_10_perovskites_main_0001.aiida)``.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen
+
+DEFAULT_URL = "https://object.cscs.ch/v1/AUTH_b1d80408b3d340db9f03d373bbde5c1e/marvel-vms/tutorials/"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "aiida-tutorials", "downloads"
+)
+DEFAULT_MAX_SIZE = 5 * 1024**3
+
+
+def get_url(source):
+    """Return the URL of an archive, given either its URL or its name relative to `AIIDA_ARCHIVE_URL`.
+
+    URLs of the tutorial archives on the default server are redirected to `AIIDA_ARCHIVE_URL` as well, so a mirror
+    can be used without changing the URLs in the tutorial.
+    """
+    if source.startswith(DEFAULT_URL):
+        source = source[len(DEFAULT_URL) :]
+    if urlparse(source).scheme:
+        return source
+    return urljoin(os.environ.get("AIIDA_ARCHIVE_URL") or DEFAULT_URL, source)
+
+
+def load_index(cache_dir):
+    """Return the index of the cache, i.e. the SHA256 checksum of the archive downloaded from each URL."""
+    index_file = os.path.join(cache_dir, "index.json")
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def save_index(cache_dir, index):
+    """Write the index of the cache atomically."""
+    with tempfile.NamedTemporaryFile(
+        "w", dir=cache_dir, delete=False, encoding="utf-8"
+    ) as handle:
+        json.dump(index, handle, indent=2)
+    os.replace(handle.name, os.path.join(cache_dir, "index.json"))
+
+
+def get_object_path(cache_dir, sha256, url):
+    """Return the path of the cached archive with the given checksum, keeping the extension of the URL."""
+    extension = os.path.splitext(urlparse(url).path)[1]
+    return os.path.join(cache_dir, "objects", sha256 + extension)
+
+
+def download(url, directory, sha256=None):
+    """Download a file into a directory, computing its SHA256 checksum while it is written.
+
+    :param sha256: the expected checksum of the file
+    :raises ValueError: if the checksum of the downloaded file does not match the expected one
+    :return: tuple of the path of the temporary file and its checksum
+    """
+    checksum = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        dir=directory, suffix=".partial", delete=False
+    ) as handle:
+        try:
+            with urlopen(url) as response:
+                for chunk in iter(lambda: response.read(1024 * 1024), b""):
+                    checksum.update(chunk)
+                    handle.write(chunk)
+            if sha256 is not None and checksum.hexdigest() != sha256:
+                raise ValueError(
+                    "Checksum of {} is {}, expected {}".format(
+                        url, checksum.hexdigest(), sha256
+                    )
+                )
+        except BaseException:
+            # Do not leave partial downloads in the cache, where they are not pruned
+            handle.close()
+            os.remove(handle.name)
+            raise
+    return handle.name, checksum.hexdigest()
+
+
+def prune_cache(cache_dir, max_size, keep=()):
+    """Remove the least recently used archives until the cache is no larger than `max_size` bytes.
+
+    :param keep: paths of archives that should not be removed
+    """
+    directory = os.path.join(cache_dir, "objects")
+    entries = []
+    for entry in os.scandir(directory):
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        if path not in keep:
+            os.remove(path)
+            size -= entry_size
+
+
+def fetch_archive(source, sha256=None, cache_dir=None, offline=None, max_size=None):
+    """Return the path of an archive in the cache, downloading it if it is not cached yet.
+
+    :param source: the URL of the archive, or its name relative to `AIIDA_ARCHIVE_URL`
+    :param sha256: the expected SHA256 checksum of the archive, which is verified when it is downloaded. Without it,
+        the archive is not verified, and an archive that is already in the cache is returned as is in both cases.
+    :param cache_dir: the cache directory, by default `AIIDA_ARCHIVE_CACHE`
+    :param offline: whether to only look in the cache, by default `AIIDA_ARCHIVE_OFFLINE`
+    :param max_size: the maximum size of the cache in bytes, by default `AIIDA_ARCHIVE_CACHE_SIZE`
+    :raises FileNotFoundError: if the archive is not cached in offline mode
+    """
+    cache_dir = cache_dir or os.environ.get("AIIDA_ARCHIVE_CACHE", DEFAULT_CACHE_DIR)
+    if offline is None:
+        offline = os.environ.get("AIIDA_ARCHIVE_OFFLINE", "0") == "1"
+    if max_size is None:
+        max_size = int(os.environ.get("AIIDA_ARCHIVE_CACHE_SIZE", DEFAULT_MAX_SIZE))
+
+    url = get_url(source)
+    os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+    index = load_index(cache_dir)
+
+    cached = sha256 or index.get(url)
+    if cached is not None:
+        path = get_object_path(cache_dir, cached, url)
+        if os.path.exists(path):
+            # The modification time is used to find the least recently used archives
+            os.utime(path)
+            return path
+
+    if offline:
+        raise FileNotFoundError(
+            "Archive {} is not in the cache {} and offline mode is enabled".format(
+                url, cache_dir
+            )
+        )
+
+    partial, checksum = download(url, cache_dir, sha256)
+    path = get_object_path(cache_dir, checksum, url)
+    os.replace(partial, path)
+
+    # Reload the index, which can have been updated by another process in the meantime
+    index = load_index(cache_dir)
+    index[url] = checksum
+    save_index(cache_dir, index)
+    prune_cache(cache_dir, max_size, keep=(path,))
+    return path
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "archives", nargs="+", help="URLs of archives, or names relative to the URL"
+    )
+    parser.add_argument(
+        "--sha256", help="expected checksum of the archive, if a single one is fetched"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=None,
+        help="only return archives that are already in the cache",
+    )
+    parser.add_argument("--cache-dir", help="the cache directory")
+    args = parser.parse_args()
+
+    if args.sha256 and len(args.archives) > 1:
+        parser.error("--sha256 can only be used when fetching a single archive")
+    for archive in args.archives:
+        print(
+            fetch_archive(
+                archive,
+                sha256=args.sha256,
+                cache_dir=args.cache_dir,
+                offline=args.offline,
+            )
+        )
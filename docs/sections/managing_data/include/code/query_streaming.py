@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Stream the results of a `QueryBuilder` in batches, projecting only the columns that are needed.
+
+`query.all()` loads all results into memory at once, and a query that projects whole nodes creates an ORM object for
+every row. On a large database, project only the columns you need instead, e.g. `uuid` or `attributes.wfc_cutoff`,
+and iterate over the results with the functions of this module. They fetch the rows in batches of `batch_size`, which
+uses a server-side cursor on PostgreSQL, so iterating over the rows takes constant memory. For example::
+
+    query = QueryBuilder()
+    query.append(PwCalculation, tag='pw')
+    query.append(Dict, with_incoming='pw', project=['attributes.wfc_cutoff'])
+    cutoffs = to_columns(query)['attributes.wfc_cutoff']
+
+As for `QueryBuilder.iterall`, do not store or modify nodes while iterating over the results.
+"""
+import numpy as np
+
+
+def get_column_names(query):
+    """Return the names of the projected columns of a query, in the order of the values of each row.
+
+    The name of a column is its projection, e.g. `attributes.wfc_cutoff`, prefixed by the tag of the entity, e.g.
+    `pw.uuid`, if several entities project the same property.
+
+    :raises ValueError: if the query does not project any column, or projects a whole entity with `*`, since it then
+        returns ORM objects
+    """
+    projections = [
+        (tag, key)
+        for tag, items in query.as_dict()["project"].items()
+        for item in items
+        for key in item
+    ]
+    # Without projections, the query returns the whole entities
+    if not projections or any(key == "*" for _, key in projections):
+        raise ValueError(
+            "The query projects whole entities, project only the columns that are needed"
+        )
+
+    keys = [key for _, key in projections]
+    return [
+        key if keys.count(key) == 1 else "{}.{}".format(tag, key)
+        for tag, key in projections
+    ]
+
+
+def iter_rows(query, batch_size=1000):
+    """Yield the rows of the query as lists of projected values, fetching them in batches of `batch_size` rows."""
+    get_column_names(query)
+    yield from query.iterall(batch_size=batch_size)
+
+
+def to_array(values):
+    """Return a list of projected values as a NumPy array, with missing numbers as `NaN` instead of `None`."""
+    array = np.array(values)
+    if array.dtype == object:
+        try:
+            return array.astype(float)
+        except (TypeError, ValueError):
+            pass
+    return array
+
+
+def convert_columns(names, rows, output):
+    """Convert a list of rows to columns, by name.
+
+    :param output: `None` for a dictionary of lists, `'numpy'` for a dictionary of NumPy arrays or `'pandas'` for a
+        `pandas.DataFrame`
+    """
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+    if output is None:
+        return columns
+    if output == "numpy":
+        return {name: to_array(values) for name, values in columns.items()}
+    if output == "pandas":
+        import pandas as pd
+
+        return pd.DataFrame(columns, columns=names)
+    raise ValueError("Unknown output `{}`, use `numpy` or `pandas`".format(output))
+
+
+def iter_batches(query, batch_size=1000, output=None):
+    """Yield the results of the query in batches of at most `batch_size` rows, as columns.
+
+    :param output: the type of the batches, see `convert_columns`
+    """
+    names = get_column_names(query)
+    rows = []
+    for row in query.iterall(batch_size=batch_size):
+        rows.append(row)
+        if len(rows) == batch_size:
+            yield convert_columns(names, rows, output)
+            rows = []
+    if rows:
+        yield convert_columns(names, rows, output)
+
+
+def to_columns(query, batch_size=1000, output="numpy"):
+    """Return all results of the query as columns, fetched in batches of `batch_size` rows.
+
+    Only the projected values are kept in memory, one NumPy array per column, instead of one ORM object per node.
+
+    :param output: `'numpy'` for a dictionary of NumPy arrays or `'pandas'` for a `pandas.DataFrame`
+    """
+    names = get_column_names(query)
+    batches = list(iter_batches(query, batch_size, "numpy"))
+    if batches:
+        columns = {
+            name: np.concatenate([batch[name] for batch in batches]) for name in names
+        }
+    else:
+        columns = {name: np.array([]) for name in names}
+    if output == "numpy":
+        return columns
+    if output == "pandas":
+        import pandas as pd
+
+        return pd.DataFrame(columns, columns=names)
+    raise ValueError("Unknown output `{}`, use `numpy` or `pandas`".format(output))
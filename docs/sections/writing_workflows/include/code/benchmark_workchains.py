@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the engine and database overhead of the tutorial work chains.
+
+The work chains are run with a code for the `core.arithmetic.add` plugin whose executable returns immediately, e.g. the
+`add` code of the tutorial that runs `/bin/bash` on `localhost`, so the timings do not depend on the runtime of a real
+code. The `EquationOfState` work chain is benchmarked as well if a code for `quantumespresso.pw` is given, which
+should run the `stub_pw.py` script of this directory instead of `pw.x`. For every outline step the latency, CPU time,
+number of SQL statements, SQL writes and nodes stored are recorded with the `InstrumentationMixin` of
+`instrumentation.py`, and the throughput is measured for different numbers of work chains running concurrently in the
+same interpreter.
+
+The SQL statements of a step do not depend on the concurrency, but its latency and CPU time include the other work
+chains that run while it waits for a process function, so the steps are reported for every concurrency separately.
+
+Run with e.g. ``python benchmark_workchains.py add@localhost --concurrency 1 10 50 --output baseline.json`` from this
+directory, adding ``--pw-code pw-stub --pseudo-family SSSP/1.1/PBE/efficiency`` and the `realworld` directory to the
+`PYTHONPATH` for the `EquationOfState` work chain, and compare the output with that of a previous version of AiiDA to
+find regressions.
+"""
+import collections
+import json
+import time
+
+from aiida.orm import Int, Str, StructureData, load_code
+
+from instrumentation import (
+    INSTRUMENTATION_EXTRA,
+    METRICS,
+    InstrumentationMixin,
+    InstrumentedMultiplyAddWorkChain,
+    get_sql_counter,
+)
+from realworld.concurrency import run_concurrently
+from workchain.addcalcjobworkchain import AddCalcjobWorkChain
+
+
+class InstrumentedAddCalcjobWorkChain(InstrumentationMixin, AddCalcjobWorkChain):
+    """`AddCalcjobWorkChain` that records the metrics of its outline steps."""
+
+    instrumented_steps = ("add", "result")
+
+
+def get_silicon_structure(alat=5.43):
+    """Return a stored structure of silicon in the diamond structure, with the lattice parameter in ang."""
+    structure = StructureData(
+        cell=[[0, alat / 2, alat / 2], [alat / 2, 0, alat / 2], [alat / 2, alat / 2, 0]]
+    )
+    structure.append_atom(position=(0, 0, 0), symbols="Si")
+    structure.append_atom(position=(alat / 4, alat / 4, alat / 4), symbols="Si")
+    return structure.store()
+
+
+def get_workchains(code, pw_code=None, pseudo_family_label=None):
+    """Return the work chains that are benchmarked, with a function that returns the inputs of the n-th work chain.
+
+    :param pw_code: the code for `quantumespresso.pw` to benchmark `EquationOfState` with, if any
+    """
+    workchains = {
+        "MultiplyAddWorkChain": (
+            InstrumentedMultiplyAddWorkChain,
+            lambda n: {"x": Int(n), "y": Int(2), "z": Int(3), "code": code},
+        ),
+        "AddCalcjobWorkChain": (
+            InstrumentedAddCalcjobWorkChain,
+            lambda n: {"x": Int(n), "y": Int(1), "code": code},
+        ),
+    }
+    if pw_code is not None:
+        # Needs the `realworld` directory in the `PYTHONPATH`
+        from eos_workchain_instrumented import InstrumentedEquationOfState
+
+        structure = get_silicon_structure()
+        workchains["EquationOfState"] = (
+            InstrumentedEquationOfState,
+            lambda n: {
+                "code": pw_code,
+                "pseudo_family_label": Str(pseudo_family_label),
+                "structure": structure,
+            },
+        )
+    return workchains
+
+
+def main(
+    code_label,
+    concurrency,
+    output=None,
+    pw_code_label=None,
+    pseudo_family_label="SSSP/1.1/PBE/efficiency",
+):
+    """Run the benchmarks, print a summary and optionally write all results to a JSON file."""
+    code = load_code(code_label)
+    pw_code = load_code(pw_code_label) if pw_code_label is not None else None
+    counter = get_sql_counter()
+
+    throughput = []
+    # Metrics of every outline step summed over the work chains of each concurrency, see `InstrumentationMixin`
+    totals = collections.defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    workchains = get_workchains(code, pw_code, pseudo_family_label)
+    for name, (process_class, get_inputs) in workchains.items():
+        for num_workchains in concurrency:
+            inputs = {n: get_inputs(n) for n in range(num_workchains)}
+            statements = counter["sql_queries"]
+            start = time.perf_counter()
+            nodes = run_concurrently(process_class, inputs).values()
+            elapsed = time.perf_counter() - start
+            throughput.append(
+                {
+                    "workchain": name,
+                    "concurrency": num_workchains,
+                    "seconds": elapsed,
+                    "workchains_per_second": num_workchains / elapsed,
+                    "statements_per_workchain": (counter["sql_queries"] - statements)
+                    / num_workchains,
+                    "failed": sum(not node.is_finished_ok for node in nodes),
+                }
+            )
+            for node in nodes:
+                for step, metrics in node.base.extras.get(
+                    INSTRUMENTATION_EXTRA, {}
+                ).items():
+                    for metric, value in metrics.items():
+                        totals[(name, num_workchains, step)][metric] += value
+
+    steps = []
+    for (workchain, num_workchains, step), total in totals.items():
+        steps.append(
+            {
+                "workchain": workchain,
+                "concurrency": num_workchains,
+                "step": step,
+                "calls": total["calls"],
+                "mean_latency_ms": 1000 * total["wall_seconds"] / total["calls"],
+                "mean_cpu_ms": 1000 * total["cpu_seconds"] / total["calls"],
+                "statements_per_call": total["sql_queries"] / total["calls"],
+                "writes_per_call": total["sql_writes"] / total["calls"],
+                "nodes_stored_per_call": total["nodes_stored"] / total["calls"],
+            }
+        )
+
+    print("Outline steps:")
+    for result in steps:
+        print(
+            "  {workchain:24} {concurrency:5d} concurrent  {step:16} {calls:5d} calls  "
+            "mean {mean_latency_ms:8.2f} ms  CPU {mean_cpu_ms:8.2f} ms  "
+            "{statements_per_call:6.1f} statements  {writes_per_call:6.1f} writes  "
+            "{nodes_stored_per_call:6.1f} nodes stored".format(**result)
+        )
+    print("Throughput:")
+    for result in throughput:
+        print(
+            "  {workchain:24} {concurrency:5d} concurrent  {seconds:8.2f} s  "
+            "{workchains_per_second:6.2f} work chains/s  "
+            "{statements_per_workchain:7.1f} statements/work chain  "
+            "{failed} failed".format(**result)
+        )
+
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as handle:
+            json.dump({"steps": steps, "throughput": throughput}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from aiida import load_profile
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("code", help="label of a code for `core.arithmetic.add`")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="numbers of work chains to run concurrently",
+    )
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument(
+        "--pw-code",
+        help="label of a code for `quantumespresso.pw` running `stub_pw.py`, to benchmark `EquationOfState`",
+    )
+    parser.add_argument(
+        "--pseudo-family",
+        default="SSSP/1.1/PBE/efficiency",
+        help="label of the pseudopotential family for `EquationOfState`",
+    )
+    args = parser.parse_args()
+
+    load_profile()
+    main(args.code, args.concurrency, args.output, args.pw_code, args.pseudo_family)
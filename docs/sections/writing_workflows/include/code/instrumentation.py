@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of the outline steps of work chains.
+
+Subclass a work chain together with the `InstrumentationMixin` and list the outline steps to instrument, e.g.::
+
+    class InstrumentedMultiplyAddWorkChain(InstrumentationMixin, MultiplyAddWorkChain):
+        instrumented_steps = ("multiply", "add", "validate_result", "result")
+
+For every step, the wall time, CPU time, number of SQL queries, SQL writes and nodes stored are summed over its calls
+and attached to the work chain node as the `instrumentation` extra when it terminates. Run
+``python instrumentation.py`` from this directory to print the metrics of all instrumented work chains in the
+Prometheus text format.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+
+from aiida.manage import get_manager
+from aiida.orm import QueryBuilder, WorkflowNode
+from sqlalchemy import event
+
+from multiply_add import MultiplyAddWorkChain
+
+# Extra of the work chain node with the metrics of its outline steps
+INSTRUMENTATION_EXTRA = "instrumentation"
+
+# Metrics recorded for every step, with their help text for the Prometheus text format
+METRICS = {
+    "calls": "Number of times the outline step was called.",
+    "wall_seconds": "Wall time spent in the outline step.",
+    "cpu_seconds": "CPU time of the interpreter spent in the outline step.",
+    "sql_queries": "SQL statements executed in the outline step.",
+    "sql_writes": "SQL INSERT, UPDATE and DELETE statements executed in the outline step.",
+    "nodes_stored": "Nodes stored in the outline step.",
+}
+
+# Metrics that are counted by the SQL listener of `get_sql_counter`
+SQL_METRICS = ("sql_queries", "sql_writes", "nodes_stored")
+
+# SQL statements executed by the storage backend of this interpreter, see `get_sql_counter`
+_SQL_COUNTER = {}
+
+# Task that runs the current instrumented step and the counts of its SQL statements, see `instrumented_step`
+_STEP_COUNTER = contextvars.ContextVar("instrumented step", default=None)
+
+
+def get_current_task():
+    """Return the task that is running on the event loop of this thread, or `None` outside of a task."""
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+def count_statement(counter, statement):
+    """Add an SQL statement to the counts of `counter`."""
+    statement = statement.lstrip().upper()
+    counter["sql_queries"] += 1
+    if statement.startswith(("INSERT", "UPDATE", "DELETE")):
+        counter["sql_writes"] += 1
+    if statement.startswith("INSERT INTO DB_DBNODE "):
+        counter["nodes_stored"] += 1
+
+
+def get_sql_counter():
+    """Return a dictionary with the number of SQL statements, writes and node inserts executed in this interpreter.
+
+    The counts are kept up to date by a `before_cursor_execute` listener on the engine of the storage backend, which
+    is registered on the first call. The listener also counts the statements of the instrumented step that is being
+    run, if any, see `instrumented_step`.
+    """
+    if not _SQL_COUNTER:
+        _SQL_COUNTER.update(dict.fromkeys(SQL_METRICS, 0))
+
+        def count(_connection, _cursor, statement, *_):
+            count_statement(_SQL_COUNTER, statement)
+            step = _STEP_COUNTER.get()
+            if step is not None and step[0] is get_current_task():
+                count_statement(step[1], statement)
+
+        engine = get_manager().get_profile_storage().get_session().bind
+        event.listen(engine, "before_cursor_execute", count)
+
+    return _SQL_COUNTER
+
+
+def instrumented_step(step):
+    """Decorate an outline step of an `InstrumentationMixin` work chain to record its metrics in the context.
+
+    A step that runs a process function, e.g. a calcfunction, waits for it on the event loop, which runs the steps of
+    other processes in the meantime. The SQL statements are therefore only counted if they are executed by the task of
+    the process, which includes the process functions it runs but not the other processes, nor the processes it
+    submits, which are run in tasks of their own. The wall time and CPU time are measured around the step, so they do
+    include the time of other processes that are run while it waits: compare them at the same concurrency.
+    """
+
+    @functools.wraps(step)
+    def wrapper(self):
+        get_sql_counter()
+        counter = dict.fromkeys(SQL_METRICS, 0)
+        token = _STEP_COUNTER.set((get_current_task(), counter))
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = step(self)
+        finally:
+            _STEP_COUNTER.reset(token)
+
+        metrics = self.ctx.instrumentation.setdefault(
+            step.__name__, {metric: 0 for metric in METRICS}
+        )
+        metrics["calls"] += 1
+        metrics["wall_seconds"] += time.perf_counter() - wall
+        metrics["cpu_seconds"] += time.process_time() - cpu
+        for metric, value in counter.items():
+            metrics[metric] += value
+        return result
+
+    return wrapper
+
+
+class InstrumentationMixin:
+    """Mixin for work chains that records the metrics of the outline steps listed in `instrumented_steps`.
+
+    Put the mixin before the work chain in the bases of the instrumented class.
+    """
+
+    instrumented_steps = ()
+
+    def __init_subclass__(cls, **kwargs):
+        """Wrap the instrumented steps with `instrumented_step`."""
+        super().__init_subclass__(**kwargs)
+        for name in cls.__dict__.get("instrumented_steps", ()):
+            setattr(cls, name, instrumented_step(getattr(cls, name)))
+
+    def on_create(self):
+        """Initialize the metrics in the context."""
+        super().on_create()
+        self.ctx.instrumentation = {}
+
+    def on_terminated(self):
+        """Attach the metrics of all steps to the node."""
+        super().on_terminated()
+        self.node.base.extras.set(INSTRUMENTATION_EXTRA, self.ctx.instrumentation)
+
+
+class InstrumentedMultiplyAddWorkChain(InstrumentationMixin, MultiplyAddWorkChain):
+    """`MultiplyAddWorkChain` that records the metrics of its outline steps."""
+
+    instrumented_steps = ("multiply", "add", "validate_result", "result")
+
+
+def get_prometheus_metrics(process_label=None):
+    """Return the metrics of all instrumented work chains in the Prometheus text format.
+
+    The metrics are summed over all work chains with the same process label, and fetched with a single query.
+
+    :param process_label: only include the work chains with this process label
+    """
+    filters = {"extras": {"has_key": INSTRUMENTATION_EXTRA}}
+    if process_label is not None:
+        filters["attributes.process_label"] = process_label
+
+    query = QueryBuilder()
+    query.append(
+        WorkflowNode,
+        filters=filters,
+        project=[
+            "attributes.process_label",
+            "extras.{}".format(INSTRUMENTATION_EXTRA),
+        ],
+    )
+
+    totals = {}
+    for label, steps in query.iterall():
+        for step, metrics in steps.items():
+            total = totals.setdefault((label, step), dict.fromkeys(METRICS, 0))
+            for metric, value in metrics.items():
+                total[metric] += value
+
+    lines = []
+    for metric, description in METRICS.items():
+        name = "aiida_workchain_step_{}".format(metric)
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} counter".format(name))
+        for (label, step), total in sorted(totals.items()):
+            lines.append(
+                '{}{{process_label="{}",step="{}"}} {}'.format(
+                    name, label, step, total[metric]
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from aiida import load_profile
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--process-label", help="only include these work chains")
+    args = parser.parse_args()
+
+    load_profile()
+    print(get_prometheus_metrics(args.process_label), end="")
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Vectorised multiply-add calcfunction for parameter sweeps."""
+import numpy as np
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData, BaseType, List
+
+
+def to_array(node):
+    """Return the values of an `ArrayData` with a single array, a `List` or a number node as a NumPy array.
+
+    :raises ValueError: if an `ArrayData` node does not contain exactly one array
+    """
+    if isinstance(node, ArrayData):
+        names = node.get_arraynames()
+        if len(names) != 1:
+            raise ValueError(
+                "ArrayData<{}> should contain a single array, found: {}".format(
+                    node.pk, ", ".join(names)
+                )
+            )
+        return node.get_array(names[0])
+    if isinstance(node, List):
+        return np.array(node.get_list())
+    if isinstance(node, BaseType):
+        return np.array(node.value)
+    raise TypeError("Unsupported input type {}".format(type(node).__name__))
+
+
+@calcfunction
+def multiply_add_array(x, y, z):
+    """Compute `x * y + z` for all elements of the inputs in a single calculation.
+
+    Contrary to calling the `multiply` and `add` calculation functions for every element, the provenance graph only
+    contains a single calculation and a single output node for the whole batch. Each input can be an `ArrayData` with
+    a single array, a `List` or a number, and the inputs are broadcast against each other. For large batches, prefer
+    `ArrayData` inputs, which are stored as binary files instead of JSON in the database.
+
+    :return: `ArrayData` with the results in the `result` array
+    """
+    result = ArrayData()
+    result.set_array("result", to_array(x) * to_array(y) + to_array(z))
+    return result
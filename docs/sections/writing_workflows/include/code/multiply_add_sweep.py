@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Sweep version of the MultiplyAddWorkChain that submits the calculations in bounded waves."""
+from aiida.engine import WorkChain, append_, calcfunction, while_
+from aiida.orm import Code, Int, List
+from aiida.plugins.factories import CalculationFactory
+
+from multiply_add import multiply
+
+ArithmeticAddCalculation = CalculationFactory("core.arithmetic.add")
+
+
+def validate_max_concurrent(node, _):
+    """Validate the `max_concurrent` input."""
+    if node.value < 1:
+        return "The maximum number of concurrent calculations should be at least one."
+
+
+def validate_inputs(inputs, _):
+    """Validate that the `x`, `y` and `z` lists have the same length."""
+    lengths = {len(inputs[key].get_list()) for key in ("x", "y", "z")}
+    if len(lengths) != 1:
+        return "The lists `x`, `y` and `z` should have the same length."
+
+
+@calcfunction
+def split_items(x, y, z):
+    """Split the `x`, `y` and `z` lists into an `Int` node per item, with the labels `x_<index>`, `y_<index>` etc."""
+    return {
+        "{}_{}".format(name, index): Int(value)
+        for name, values in (("x", x), ("y", y), ("z", z))
+        for index, value in enumerate(values.get_list())
+    }
+
+
+class MultiplyAddSweepWorkChain(WorkChain):
+    """WorkChain to compute `x * y + z` for every item of the lists `x`, `y` and `z`.
+
+    The `ArithmeticAddCalculation` of the items are submitted in waves of at most `max_concurrent` calculations, and the
+    results of each wave are checked and attached as outputs as soon as the wave is done. An item with a negative
+    result or a failed calculation does not abort the sweep, but the work chain finishes with a non-zero exit code.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Specify inputs and outputs."""
+        super().define(spec)
+        spec.input("x", valid_type=List)
+        spec.input("y", valid_type=List)
+        spec.input("z", valid_type=List)
+        spec.input("code", valid_type=Code)
+        spec.input(
+            "max_concurrent",
+            valid_type=Int,
+            default=lambda: Int(10),
+            validator=validate_max_concurrent,
+            help="Maximum number of calculations that are submitted at the same time.",
+        )
+        spec.inputs.validator = validate_inputs
+        spec.outline(
+            cls.setup,
+            while_(cls.should_submit)(
+                cls.submit_wave,
+                cls.inspect_wave,
+            ),
+            cls.result,
+        )
+        spec.output_namespace(
+            "results",
+            valid_type=Int,
+            dynamic=True,
+            help="The result of every successful item, with the label `item_<index>`.",
+        )
+        spec.exit_code(
+            400,
+            "ERROR_NEGATIVE_NUMBER",
+            message="The result of the items {indices} is a negative number.",
+        )
+        spec.exit_code(
+            401,
+            "ERROR_CALCULATION_FAILED",
+            message="The calculation of the items {indices} failed.",
+        )
+
+    def setup(self):
+        """Initialize the context and split the lists into the items, keeping the provenance of each item."""
+        self.ctx.item_nodes = split_items(self.inputs.x, self.inputs.y, self.inputs.z)
+        self.ctx.next_index = 0
+        # Index of the item of each submitted calculation, by pk
+        self.ctx.indices = {}
+        self.ctx.negative = []
+        self.ctx.failed = []
+
+    def should_submit(self):
+        """Return whether there are items left to submit."""
+        return self.ctx.next_index < len(self.inputs.x)
+
+    def submit_wave(self):
+        """Submit the calculations for the next `max_concurrent` items."""
+        start = self.ctx.next_index
+        stop = min(start + self.inputs.max_concurrent.value, len(self.inputs.x))
+        self.ctx.additions = []
+
+        for index in range(start, stop):
+            product = multiply(
+                self.ctx.item_nodes["x_{}".format(index)],
+                self.ctx.item_nodes["y_{}".format(index)],
+            )
+            inputs = {
+                "x": product,
+                "y": self.ctx.item_nodes["z_{}".format(index)],
+                "code": self.inputs.code,
+            }
+            calcjob_node = self.submit(ArithmeticAddCalculation, **inputs)
+            self.ctx.indices[str(calcjob_node.pk)] = index
+            self.to_context(additions=append_(calcjob_node))
+
+        self.ctx.next_index = stop
+
+    def inspect_wave(self):
+        """Check the result of each item of the wave and attach the successful ones as outputs."""
+        for calculation in self.ctx.additions:
+            index = self.ctx.indices[str(calculation.pk)]
+
+            # The parser attaches the `sum` even if it flags a negative result with an exit code
+            if "sum" in calculation.outputs and calculation.outputs.sum.value < 0:
+                self.report("The result of item {} is a negative number".format(index))
+                self.ctx.negative.append(index)
+            elif not calculation.is_finished_ok:
+                self.report(
+                    "Calculation of item {} failed with exit status {}".format(
+                        index, calculation.exit_status
+                    )
+                )
+                self.ctx.failed.append(index)
+            else:
+                self.out("results.item_{}".format(index), calculation.outputs.sum)
+
+    def result(self):
+        """Return an exit code if any item failed."""
+        if self.ctx.failed:
+            return self.exit_codes.ERROR_CALCULATION_FAILED.format(
+                indices=self.ctx.failed
+            )
+        if self.ctx.negative:
+            return self.exit_codes.ERROR_NEGATIVE_NUMBER.format(
+                indices=self.ctx.negative
+            )
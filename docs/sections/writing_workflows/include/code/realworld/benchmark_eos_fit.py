@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the batched Birch Murnaghan fit against fitting one equation of state at a time.
+
+Run with e.g. ``python benchmark_eos_fit.py --num-curves 1000`` from this directory.
+"""
+import time
+
+import numpy as np
+
+from utils import EOS_MODELS, birch_murnaghan, fit_eos_batch, fit_eos_params
+
+
+def generate_curves(num_curves, noise=1e-4, seed=0):
+    """Generate synthetic EOS curves sampled at the scale factors of the tutorial work chain."""
+    rng = np.random.default_rng(seed)
+    params = np.stack(
+        [
+            rng.uniform(-300.0, -100.0, num_curves),  # E0
+            rng.uniform(15.0, 60.0, num_curves),  # V0
+            rng.uniform(0.3, 1.5, num_curves),  # B0
+            rng.uniform(3.5, 5.0, num_curves),  # B01
+        ],
+        axis=-1,
+    )
+    scale_facs = np.array([0.96, 0.98, 1.0, 1.02, 1.04])
+    volumes = (
+        params[:, 1:2] * scale_facs**3 * rng.uniform(0.97, 1.03, (num_curves, 1))
+    )
+    energies = birch_murnaghan(volumes, *params.T[..., np.newaxis])
+    energies += rng.normal(0.0, noise, volumes.shape)
+    return volumes, energies, params
+
+
+def main(num_curves, model="birch_murnaghan"):
+    """Fit the same curves with both methods and print the timings and the largest difference in the parameters."""
+    volumes, energies, _ = generate_curves(num_curves)
+
+    start = time.perf_counter()
+    batch_params, _ = fit_eos_batch(volumes, energies, model=model)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loop_params = np.array(
+        [fit_eos_params(V, E, model=model)[0] for V, E in zip(volumes, energies)]
+    )
+    loop_time = time.perf_counter() - start
+
+    difference = np.max(np.abs(batch_params - loop_params) / np.abs(loop_params))
+    print(f"Fitted {num_curves} curves with the {model} equation of state")
+    print(f"  per-curve loop: {loop_time:.3f} s")
+    print(
+        f"  batched:        {batch_time:.3f} s ({loop_time / batch_time:.0f}x faster)"
+    )
+    print(f"  largest relative difference in the parameters: {difference:.2e}")
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-curves", type=int, default=1000)
+    parser.add_argument("--model", choices=list(EOS_MODELS), default="birch_murnaghan")
+    args = parser.parse_args()
+    main(args.num_curves, args.model)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Run several processes concurrently on the event loop of the current runner."""
+import asyncio
+
+from aiida.manage import get_manager
+
+
+def run_concurrently(process_class, inputs):
+    """Run a process for each set of inputs concurrently on the event loop of the current runner.
+
+    Contrary to calling `run` once per set of inputs, which blocks until each process has terminated, all processes
+    are started at once and this returns as soon as the last one terminated. When called within a work function, the
+    processes are linked to it as called processes, exactly as with `run`.
+
+    :param process_class: the process class to run, e.g. `PwCalculation`
+    :param inputs: dictionary of label to the inputs (or builder) for each process
+    :return: dictionary of label to the node of each process
+    """
+    runner = get_manager().get_runner()
+    processes = {
+        label: runner.instantiate_process(process_class, **process_inputs)
+        for label, process_inputs in inputs.items()
+    }
+
+    async def run_all():
+        await asyncio.gather(
+            *(process.step_until_terminated() for process in processes.values())
+        )
+
+    runner.run_until_complete(run_all())
+
+    return {label: process.node for label, process in processes.items()}
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Equation of State WorkChain that adapts the sampled scale factors to the fit."""
+import numpy as np
+from aiida.engine import WorkChain, append_, while_
+from aiida.orm import ArrayData, Code, Float, Int, List, Str, StructureData, load_group
+from aiida.plugins import CalculationFactory
+
+from rescale_batch import rescale_batch
+from utils import (
+    EOS_MODELS,
+    create_eos_array,
+    fit_eos_params,
+    generate_scf_input_params,
+    get_eos_values,
+    get_output_parameters,
+)
+
+PwCalculation = CalculationFactory("quantumespresso.pw")
+
+
+def validate_scale_factors(node, _):
+    """Validate the `initial_scale_factors` input."""
+    if len(node.get_list()) < 4:
+        return "At least four scale factors are needed to fit the equation of state."
+    if any(factor <= 0 for factor in node.get_list()):
+        return "The scale factors have to be positive."
+
+
+def validate_eos_model(node, _):
+    """Validate the `eos_model` input."""
+    if node.value not in EOS_MODELS:
+        return "Unknown equation of state `{}`, choose one of {}.".format(
+            node.value, ", ".join(EOS_MODELS)
+        )
+
+
+def validate_inputs(inputs, _):
+    """Validate that the budget of calculations covers the initial scale factors."""
+    if inputs["max_calculations"].value < len(inputs["initial_scale_factors"]):
+        return "The `max_calculations` should be at least the number of `initial_scale_factors`."
+
+
+class AdaptiveEquationOfState(WorkChain):
+    """WorkChain to compute the Equation of State using Quantum ESPRESSO, sampling only the points it needs.
+
+    The work chain starts from a coarse set of scale factors and fits the equation of state. Then, until the relative
+    uncertainties of V0 and B0 are below the tolerances or the budget of calculations is spent, it submits new
+    calculations: beyond the sampled range if the minimum is not bracketed, and around the minimum otherwise.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Specify inputs and outputs."""
+        super().define(spec)
+        spec.input("code", valid_type=Code)
+        spec.input("pseudo_family_label", valid_type=Str)
+        spec.input("structure", valid_type=StructureData)
+        spec.input(
+            "initial_scale_factors",
+            valid_type=List,
+            default=lambda: List(list=[0.94, 0.98, 1.02, 1.06]),
+            validator=validate_scale_factors,
+            help="Coarse scale factors (of the lattice constant) that are computed first.",
+        )
+        spec.input(
+            "max_calculations",
+            valid_type=Int,
+            default=lambda: Int(10),
+            help="Maximum number of `PwCalculation`s that will be submitted.",
+        )
+        spec.input(
+            "volume_tolerance",
+            valid_type=Float,
+            default=lambda: Float(1e-3),
+            help="Target relative standard error of the equilibrium volume V0.",
+        )
+        spec.input(
+            "bulk_modulus_tolerance",
+            valid_type=Float,
+            default=lambda: Float(1e-2),
+            help="Target relative standard error of the bulk modulus B0.",
+        )
+        spec.input(
+            "eos_model",
+            valid_type=Str,
+            default=lambda: Str("birch_murnaghan"),
+            validator=validate_eos_model,
+            help="Equation of state that is fitted to decide where to sample.",
+        )
+        spec.inputs.validator = validate_inputs
+        spec.output(
+            "eos",
+            valid_type=ArrayData,
+            help="Volumes and energies of the calculations, with the fitted parameters of the equation of state.",
+        )
+        spec.outline(
+            cls.setup,
+            cls.run_eos,
+            cls.inspect_eos,
+            while_(cls.should_refine)(
+                cls.run_eos,
+                cls.inspect_eos,
+            ),
+            cls.results,
+        )
+        spec.exit_code(
+            401,
+            "ERROR_NOT_ENOUGH_POINTS",
+            message="Less than four calculations finished successfully.",
+        )
+        spec.exit_code(
+            402,
+            "ERROR_NOT_CONVERGED",
+            message="The budget of calculations was spent before reaching the tolerances.",
+        )
+
+    def setup(self):
+        """Initialize the context with the coarse scale factors."""
+        self.ctx.to_run = self.inputs.initial_scale_factors.get_list()
+        # Scale factor of each submitted calculation, by pk
+        self.ctx.scale_factors = {}
+        self.ctx.converged = False
+
+    def run_eos(self):
+        """Run the calculations for the scale factors that are still to be computed."""
+        structure = self.inputs.structure
+        pseudo_family = load_group(self.inputs.pseudo_family_label.value)
+
+        # Rescale the structure for all new scale factors in a single calculation function
+        rescaled_structures = rescale_batch(structure, List(list=self.ctx.to_run))
+
+        for index, factor in enumerate(self.ctx.to_run):
+            rescaled_structure = rescaled_structures["rescaled_{}".format(index)]
+            inputs = generate_scf_input_params(
+                rescaled_structure, self.inputs.code, pseudo_family
+            )
+
+            self.report(
+                "Running an SCF calculation for {} with scale factor {}".format(
+                    structure.get_formula(), factor
+                )
+            )
+            calcjob_node = self.submit(PwCalculation, **inputs)
+            self.ctx.scale_factors[str(calcjob_node.pk)] = factor
+            # Ask the workflow to continue when the results are ready and append them to the context
+            self.to_context(calculations=append_(calcjob_node))
+
+        self.ctx.to_run = []
+
+    def get_finished_calculations(self):
+        """Return the successful calculations, sorted by scale factor."""
+        return sorted(
+            (
+                calculation
+                for calculation in self.ctx.calculations
+                if calculation.is_finished_ok
+            ),
+            key=lambda calculation: self.ctx.scale_factors[str(calculation.pk)],
+        )
+
+    def get_gap_factors(self, count, budget):
+        """Return the scale factors in the middle of the `count` largest gaps of the sampled range, within budget."""
+        sampled = sorted(self.ctx.scale_factors.values())
+        gaps = sorted(zip(np.diff(sampled), sampled[:-1]), reverse=True)
+        to_run = [start + gap / 2.0 for gap, start in gaps[:count]]
+        return [float(factor) for factor in to_run[: max(budget, 0)]]
+
+    def inspect_eos(self):
+        """Fit the equation of state and decide which scale factors need to be computed next."""
+        calculations = self.get_finished_calculations()
+        factors = np.array(
+            [
+                self.ctx.scale_factors[str(calculation.pk)]
+                for calculation in calculations
+            ]
+        )
+        budget = self.inputs.max_calculations.value - len(self.ctx.calculations)
+
+        if len(calculations) < 4:
+            # Not enough points to fit: fill the largest gaps of the sampled range
+            self.ctx.to_run = self.get_gap_factors(4 - len(calculations), budget)
+            return
+
+        # Only project the volumes and energies needed for the fit
+        eos_values = get_eos_values(calculations)
+        volumes = [eos_values[calculation.pk][0] for calculation in calculations]
+        energies = [eos_values[calculation.pk][1] for calculation in calculations]
+        try:
+            params, covariance = fit_eos_params(
+                volumes, energies, model=self.inputs.eos_model.value
+            )
+        except (RuntimeError, ValueError) as exception:
+            # The fit did not converge with these points: sample more in the largest gaps
+            self.report(
+                "The fit with {} points failed: {}".format(len(calculations), exception)
+            )
+            self.ctx.to_run = self.get_gap_factors(2, budget)
+            return
+        with np.errstate(invalid="ignore"):
+            errors = np.sqrt(np.diag(covariance)) / np.abs(params)
+        _, V0, B0, _ = params
+
+        self.report(
+            "Fit with {} points: V0 = {:.4f} (relative error {:.1e}), "
+            "B0 = {:.4f} (relative error {:.1e})".format(
+                len(calculations), V0, errors[1], B0, errors[2]
+            )
+        )
+
+        # Scale factor of the fitted minimum, referred to the volume of the input structure
+        volume = self.inputs.structure.get_cell_volume()
+        factor_V0 = (V0 / volume) ** (1.0 / 3.0)
+        spacing = np.min(np.diff(factors))
+
+        if not factors.min() < factor_V0 < factors.max():
+            # The minimum is not bracketed: extend the sampled range on that side
+            if factor_V0 <= factors.min():
+                to_run = [factors.min() - 2 * spacing]
+            else:
+                to_run = [factors.max() + 2 * spacing]
+        elif (
+            np.isfinite(errors[[1, 2]]).all()
+            and errors[1] < self.inputs.volume_tolerance.value
+            and errors[2] < self.inputs.bulk_modulus_tolerance.value
+        ):
+            self.ctx.converged = True
+            to_run = []
+        else:
+            # Densify the sampling around the minimum
+            to_run = [factor_V0 - spacing / 2.0, factor_V0 + spacing / 2.0]
+
+        if to_run and budget <= 0:
+            self.report("The budget of calculations is spent")
+        self.ctx.to_run = [float(factor) for factor in to_run[: max(budget, 0)]]
+
+    def should_refine(self):
+        """Return whether more calculations are needed."""
+        return bool(self.ctx.to_run)
+
+    def results(self):
+        """Process results."""
+        calculations = self.get_finished_calculations()
+        if len(calculations) < 4:
+            return self.exit_codes.ERROR_NOT_ENOUGH_POINTS
+
+        output_parameters = get_output_parameters(calculations)
+        inputs = {
+            "c{}".format(index): output_parameters[calculation.pk]
+            for index, calculation in enumerate(calculations, 1)
+        }
+        eos = create_eos_array(self.inputs.eos_model, **inputs)
+
+        # Attach Equation of State results as output node to be able to plot the EOS later
+        self.out("eos", eos)
+
+        if not self.ctx.converged:
+            return self.exit_codes.ERROR_NOT_CONVERGED
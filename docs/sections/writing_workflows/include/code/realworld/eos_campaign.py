@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Submit the `EquationOfState` work chain for every structure of a group, without flooding the daemon.
+
+Run with e.g. ``python eos_campaign.py <GROUP> <CODE> <PSEUDO_FAMILY> --max-active 50`` from this directory, with this
+directory in the `PYTHONPATH` of the daemon. The script can be interrupted and run again at any time: structures for
+which an `EquationOfState` work chain with the same pseudopotential family was already submitted are skipped.
+"""
+import time
+
+from aiida.engine import submit
+from aiida.orm import (
+    QueryBuilder,
+    Str,
+    StructureData,
+    WorkChainNode,
+    load_code,
+    load_group,
+    load_node,
+)
+
+from eos_workchain import EquationOfState
+
+ACTIVE_STATES = ("created", "waiting", "running")
+
+
+def get_structures(group):
+    """Return the uuid and pk of all structures in the group, without loading the nodes."""
+    query = QueryBuilder()
+    query.append(type(group), filters={"id": group.pk}, tag="group")
+    query.append(StructureData, with_group="group", project=["uuid", "id"])
+    return query.all()
+
+
+def get_submitted(group, pseudo_family_label):
+    """Return the process state of the work chains submitted for the structures of the group.
+
+    The work chains are found through their `structure` and `pseudo_family_label` inputs, so a work chain counts as
+    submitted as soon as it is stored, even if the script was interrupted right after submitting it.
+
+    :return: dictionary of structure uuid to the process state of its most recent work chain
+    """
+    query = QueryBuilder()
+    query.append(type(group), filters={"id": group.pk}, tag="group")
+    query.append(StructureData, with_group="group", project="uuid", tag="structure")
+    query.append(
+        WorkChainNode,
+        filters={"process_type": EquationOfState.build_process_type()},
+        with_incoming="structure",
+        edge_filters={"label": "structure"},
+        project="attributes.process_state",
+        tag="eos",
+    )
+    query.append(
+        Str,
+        with_outgoing="eos",
+        edge_filters={"label": "pseudo_family_label"},
+        filters={"attributes.value": pseudo_family_label},
+    )
+    query.order_by({"eos": "ctime"})
+    return {uuid: state for uuid, state in query.iterall()}
+
+
+def run_campaign(
+    group_label,
+    code_label,
+    pseudo_family_label,
+    max_active=50,
+    rate=1.0,
+    poll_interval=60.0,
+):
+    """Submit `EquationOfState` for all structures of a group that have not been submitted yet.
+
+    At most `max_active` work chains of the campaign are active at the same time, and at most `rate` work chains are
+    submitted per second. Once all structures are submitted, this returns without waiting for the work chains to
+    finish: they are run by the daemon.
+
+    :param max_active: maximum number of work chains of the campaign that are created, waiting or running
+    :param rate: maximum number of submissions per second, must be positive
+    :param poll_interval: seconds to wait before checking again how many work chains are active
+    """
+    if rate <= 0:
+        raise ValueError("The submission rate should be positive, got {}".format(rate))
+
+    group = load_group(group_label)
+    code = load_code(code_label)
+    structures = get_structures(group)
+
+    while True:
+        submitted = get_submitted(group, pseudo_family_label)
+        pending = [pk for uuid, pk in structures if uuid not in submitted]
+        active = sum(state in ACTIVE_STATES for state in submitted.values())
+        print(
+            "Campaign {}: {} submitted ({} active), {} pending".format(
+                group.label, len(submitted), active, len(pending)
+            )
+        )
+        if not pending:
+            return
+
+        for pk in pending[: max(max_active - active, 0)]:
+            node = submit(
+                EquationOfState,
+                code=code,
+                pseudo_family_label=Str(pseudo_family_label),
+                structure=load_node(pk),
+            )
+            print("Submitted EquationOfState<{}> for structure<{}>".format(node.pk, pk))
+            time.sleep(1.0 / rate)
+
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from aiida import load_profile
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("group", help="label of the group of structures")
+    parser.add_argument("code", help="label of the Quantum ESPRESSO pw.x code")
+    parser.add_argument("pseudo_family", help="label of the pseudopotential family")
+    parser.add_argument("--max-active", type=int, default=50)
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="maximum submissions per second"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=60.0, help="seconds between checks"
+    )
+    args = parser.parse_args()
+
+    load_profile()
+    run_campaign(
+        args.group,
+        args.code,
+        args.pseudo_family,
+        args.max_active,
+        args.rate,
+        args.poll_interval,
+    )
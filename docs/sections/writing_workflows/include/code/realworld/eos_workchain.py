@@ -5,7 +5,7 @@ from aiida.orm import Code, Dict, Float, Str, StructureData, load_group
 from aiida.plugins import CalculationFactory
 
 from rescale import rescale
-from utils import generate_scf_input_params
+from utils import generate_scf_input_params, get_output_parameters
 
 PwCalculation = CalculationFactory("quantumespresso.pw")
 scale_facs = (0.96, 0.98, 1.0, 1.02, 1.04)
@@ -67,10 +67,9 @@ class EquationOfState(WorkChain):
 
     def results(self):
         """Process results."""
-        inputs = {
-            label: self.ctx[label].get_outgoing().get_node_by_label("output_parameters")
-            for label in labels
-        }
+        # Fetch the `output_parameters` of all calculations with a single query
+        output_parameters = get_output_parameters(self.ctx[label] for label in labels)
+        inputs = {label: output_parameters[self.ctx[label].pk] for label in labels}
         eos = get_eos_data(**inputs)
 
         # Attach Equation of State results as output node to be able to plot the EOS later
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Equation of State WorkChain that reuses SCF calculations with identical inputs."""
+from eos_workchain import EquationOfState
+from utils import CachingMixin
+
+
+class CachedEquationOfState(CachingMixin, EquationOfState):
+    """`EquationOfState` that reuses finished `PwCalculation`s with identical inputs instead of running them again.
+
+    This is the case e.g. for the scale factor 1.0 of a structure that was computed before, or when rerunning the work
+    chain after a failure. The cache hit rate is reported at the end of the work chain.
+    """
+
+    def results(self):
+        """Process results and report the cache hit rate."""
+        super().results()
+        self.report_cache_hits()
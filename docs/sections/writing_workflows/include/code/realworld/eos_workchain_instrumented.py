@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Equation of State WorkChain that records the metrics of its outline steps.
+
+This needs the `instrumentation.py` module of the parent directory, so add both directories to the `PYTHONPATH`.
+"""
+from instrumentation import InstrumentationMixin
+
+from eos_workchain import EquationOfState
+
+
+class InstrumentedEquationOfState(InstrumentationMixin, EquationOfState):
+    """`EquationOfState` that records the wall time, CPU time, SQL queries, writes and nodes stored of each step."""
+
+    instrumented_steps = ("run_eos", "results")
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Equation of state work function that runs its SCF calculations concurrently."""
+from aiida.engine import Process, workfunction
+from aiida.orm import List, load_group
+from aiida.plugins import CalculationFactory
+
+from concurrency import run_concurrently
+from eos_workfunction import create_eos_dictionary
+from rescale_batch import rescale_batch
+from utils import generate_scf_input_params
+
+# Load the calculation class 'PwCalculation' using its entry point 'quantumespresso.pw'
+PwCalculation = CalculationFactory("quantumespresso.pw")
+
+
+@workfunction
+def run_eos_wf_concurrent(code, pseudo_family_label, structure):
+    """Run an equation of state of a bulk crystal structure, running all SCF calculations at the same time."""
+
+    # This will print the pk of the work function
+    print("Running run_eos_wf_concurrent<{}>".format(Process.current().pid))
+
+    scale_factors = [0.96, 0.98, 1.0, 1.02, 1.04]
+    labels = ["c1", "c2", "c3", "c4", "c5"]
+    pseudo_family = load_group(pseudo_family_label.value)
+
+    # Generate all scaled structures from the initial structure
+    rescaled_structures = rescale_batch(structure, List(list=scale_factors))
+
+    # Generate the inputs for each `PwCalculation`
+    inputs = {}
+    for index, label in enumerate(labels):
+        inputs[label] = generate_scf_input_params(
+            rescaled_structures["rescaled_{}".format(index)], code, pseudo_family
+        )
+
+    print(
+        "Running {} scf calculations for {} concurrently".format(
+            len(inputs), structure.get_formula()
+        )
+    )
+    calculations = run_concurrently(PwCalculation, inputs)
+
+    # Bundle the individual results from each `PwCalculation` in a single dictionary node, as in `run_eos_wf`
+    inputs = {
+        label: node.outputs.output_parameters for label, node in calculations.items()
+    }
+    eos = create_eos_dictionary(**inputs)
+
+    # Finally, return the eos Dict node
+    return eos
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Plot the equations of state of many work functions or work chains without a display.
+
+Run with e.g. ``python plot_eos_batch.py 1234 1235 1236 --format svg`` from this directory to write one file per pk,
+or with ``--multipage eos.pdf`` to write all of them as the pages of a single PDF.
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from aiida.common.exceptions import NotExistent
+
+from utils import draw_eos, get_eos_plot_data
+
+FORMATS = ("png", "svg", "pdf")
+
+# Figure that is reused for all plots rendered in this process, see `get_figure`
+_FIGURE = None
+
+
+def get_figure():
+    """Return the figure template of the current process, creating it on first use.
+
+    The figure is created without `pyplot`, so that it is rendered with the Agg canvas without a display and it is not
+    registered in any global state. It has a single `Axes` that is cleared before every plot.
+    """
+    global _FIGURE  # pylint: disable=global-statement
+    if _FIGURE is None:
+        from matplotlib.figure import Figure
+
+        _FIGURE = Figure(figsize=(6.4, 4.8), layout="tight")
+        _FIGURE.add_subplot()
+    return _FIGURE
+
+
+def draw_page(eos_pk, data):
+    """Draw the equation of state on the figure template and return the figure."""
+    figure = get_figure()
+    axes = figure.axes[0]
+    axes.clear()
+    draw_eos(axes, *data)
+    axes.set_title("EOS<{}>".format(eos_pk))
+    return figure
+
+
+def render(eos_pk, data, file_name, fmt):
+    """Render a single equation of state to a file.
+
+    :return: the name of the written file
+    """
+    draw_page(eos_pk, data).savefig(file_name, format=fmt)
+    return file_name
+
+
+def plot_eos_batch(eos_pks, output_dir=".", fmt="png", multipage=None, processes=None):
+    """Plot the equations of state of many work functions or work chains.
+
+    The data is read from the database in this process. The fitting and rendering of the individual files is then
+    distributed over a pool of `processes` worker processes. A multi-page PDF has to be written by a single process, so
+    all pages are rendered here one after the other, reusing the same figure. The pks without an equation of state,
+    e.g. of failed work chains, are reported and skipped, and only the points are plotted if there is no fit.
+
+    :param eos_pks: pks of `run_eos_wf` work functions or equation of state work chains
+    :param output_dir: directory in which the files `EOS-<pk>.<fmt>` are written
+    :param fmt: file format, one of `FORMATS`
+    :param multipage: if given, the name of a single PDF file to which all plots are written instead
+    :param processes: number of worker processes, by default the number of CPUs
+    :return: list of the names of the written files
+    """
+    if fmt not in FORMATS:
+        raise ValueError(
+            "Unknown format `{}`, choose one of {}.".format(fmt, ", ".join(FORMATS))
+        )
+
+    data = {}
+    for eos_pk in eos_pks:
+        try:
+            data[eos_pk] = get_eos_plot_data(eos_pk)
+        except (NotExistent, ValueError) as exception:
+            print("Skipping EOS<{}>: {}".format(eos_pk, exception), file=sys.stderr)
+    if not data:
+        return []
+
+    if multipage is not None:
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        with PdfPages(multipage) as pdf:
+            for eos_pk, eos_data in data.items():
+                pdf.savefig(draw_page(eos_pk, eos_data))
+        return [multipage]
+
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [
+        (
+            eos_pk,
+            eos_data,
+            os.path.join(output_dir, "EOS-{}.{}".format(eos_pk, fmt)),
+            fmt,
+        )
+        for eos_pk, eos_data in data.items()
+    ]
+    if processes == 1 or len(jobs) <= 1:
+        return [render(*job) for job in jobs]
+
+    # Send the jobs in chunks to limit the inter-process communication, while keeping all workers busy
+    workers = processes or os.cpu_count()
+    chunksize = max(1, len(jobs) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render, *zip(*jobs), chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from aiida import load_profile
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("pks", type=int, nargs="+")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument(
+        "--multipage", metavar="FILE", help="write all plots to a single PDF file"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of worker processes"
+    )
+    args = parser.parse_args()
+
+    load_profile()
+    for file_name in plot_eos_batch(
+        args.pks, args.output_dir, args.format, args.multipage, args.jobs
+    ):
+        print(file_name)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Calculation function to rescale a structure by many scale factors at once."""
+import numpy as np
+from aiida.engine import calcfunction
+
+
+@calcfunction
+def rescale_batch(structure, scales):
+    """Calculation function to rescale a structure by each of a list of scale factors
+
+    Contrary to calling the `rescale` calculation function once per scale factor, this creates a single process node,
+    and scales the cells and positions of all structures in one NumPy operation without converting to ASE.
+
+    :param structure: An AiiDA `StructureData` to rescale
+    :param scales: A `List` of scale factors (for the lattice constant)
+    :return: A dictionary with the rescaled structures, with the labels `rescaled_0`, `rescaled_1`, ... in the order
+        of the scale factors
+    """
+    factors = np.array(scales.get_list(), dtype=float)[:, np.newaxis, np.newaxis]
+    cells = factors * np.array(structure.cell)
+    positions = factors * np.array([site.position for site in structure.sites])
+
+    rescaled_structures = {}
+    for index, (cell, position) in enumerate(zip(cells, positions)):
+        rescaled_structure = structure.clone()
+        rescaled_structure.reset_cell(cell.tolist())
+        rescaled_structure.reset_sites_positions(position.tolist())
+        rescaled_structures["rescaled_{}".format(index)] = rescaled_structure
+
+    return rescaled_structures
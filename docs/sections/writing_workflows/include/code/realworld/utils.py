@@ -1,16 +1,236 @@
 # -*- coding: utf-8 -*-
 """Helper functions."""
+import hashlib
+import json
+import time
+
 import numpy as np
+from aiida.engine import calcfunction
+from aiida.manage.caching import enable_caching
+from aiida.orm import CalcJobNode, QueryBuilder
 from aiida.plugins import CalculationFactory, DataFactory
 
+ArrayData = DataFactory("core.array")
 Dict = DataFactory("core.dict")
 KpointsData = DataFactory("core.array.kpoints")
 PwCalculation = CalculationFactory("quantumespresso.pw")
 
+# Extra in which `get_or_store_node` records the content hash of the nodes it stores
+INPUT_HASH_EXTRA = "scf_input_hash"
+
+# In-memory caches of `get_or_store_node` (content hash -> node) and `get_pseudos` ((family, kinds) -> pseudos)
+_NODE_CACHE = {}
+_PSEUDO_CACHE = {}
+
+# Resource model of `estimate_scf_resources`: wall time in seconds of one unit of `estimate_scf_cost` on one process
+# when there are no finished calculations to calibrate it, the target and maximum wall time of a calculation, the
+# safety factor applied to the estimate for the requested wall time, and the maximum number of machines
+DEFAULT_SECONDS_PER_COST = 1.0e-6
+TARGET_WALLTIME = 15 * 60
+MIN_WALLTIME = 10 * 60
+MAX_WALLTIME = 24 * 60 * 60
+WALLTIME_SAFETY_FACTOR = 3.0
+MAX_NUM_MACHINES = 4
+
+# The resources and settings are part of the hash of a calculation, only `max_wallclock_seconds` is not. So that the
+# same calculation always gets the same hash and can be taken from the cache, the MPI layout is chosen with the fixed
+# `DEFAULT_SECONDS_PER_COST`, and only the wall time follows the calibration of `get_seconds_per_cost`
+TARGET_COST_PER_MPIPROC = TARGET_WALLTIME / DEFAULT_SECONDS_PER_COST
+
+# In-memory cache of `get_seconds_per_cost`, and the number of seconds after which it is recomputed, so that long
+# running interpreters such as the daemon workers pick up the calculations that finished in the meantime
+_CALIBRATION = {}
+CALIBRATION_LIFETIME = 10 * 60
+
+
+def get_or_store_node(node_class, content, setup):
+    """Return a stored node with the given content, reusing an existing one if possible.
+
+    Nodes are looked up by a hash of their content, first in memory and then in the extras of the stored nodes, so
+    that e.g. all calculations of an equation of state share the same parameters and k-points nodes.
+
+    :param node_class: the class of the node, e.g. `Dict`
+    :param content: JSON-serializable content that fully determines the node
+    :param setup: function that takes no arguments and returns the unstored node for the content
+    :return: the stored node
+    """
+    content_hash = hashlib.sha256(
+        json.dumps([node_class.__name__, content], sort_keys=True).encode()
+    ).hexdigest()
+
+    if content_hash in _NODE_CACHE:
+        return _NODE_CACHE[content_hash]
+
+    query = QueryBuilder()
+    query.append(
+        node_class,
+        filters={"extras.{}".format(INPUT_HASH_EXTRA): content_hash},
+        subclassing=False,
+    )
+    result = query.first()
+    if result is not None:
+        node = result[0]
+    else:
+        node = setup().store()
+        node.base.extras.set(INPUT_HASH_EXTRA, content_hash)
+
+    _NODE_CACHE[content_hash] = node
+    return node
+
+
+def get_pseudos(pseudo_family, structure):
+    """Return the pseudopotentials of a family for the kinds of a structure, caching them per (family, kinds).
+
+    All rescaled structures of an equation of state have the same kinds, so the family is only queried once.
+    Note that changes to the family after the first call are not picked up.
+    """
+    key = (
+        pseudo_family.uuid,
+        tuple(sorted((kind.name, kind.symbols) for kind in structure.kinds)),
+    )
+    if key not in _PSEUDO_CACHE:
+        _PSEUDO_CACHE[key] = pseudo_family.get_pseudos(structure=structure)
+    return dict(_PSEUDO_CACHE[key])
+
+
+def estimate_scf_cost(num_atoms, volume, ecutrho, mesh):
+    """Estimate the relative cost of an SCF calculation.
+
+    The number of bands grows with the number of atoms, the size of the FFT grid with the volume times `ecutrho`
+    to the power 3/2, and every k-point of the mesh is computed separately.
+
+    :param volume: the volume of the cell in ang^3
+    :param ecutrho: the cutoff of the charge density in Ry
+    :param mesh: the k-points mesh
+    """
+    return num_atoms * volume * ecutrho**1.5 * np.prod(mesh)
+
+
+def get_seconds_per_cost(refresh=False):
+    """Return the wall time in seconds of one unit of `estimate_scf_cost` on one process.
+
+    The value is calibrated on the measured wall times of the latest successful `PwCalculation`s in the database, which
+    the parser records in the `wall_time_seconds` output, all fetched with a single query. It is cached for
+    `CALIBRATION_LIFETIME` seconds, unless `refresh` is `True`.
+    """
+    if (
+        refresh
+        or "seconds_per_cost" not in _CALIBRATION
+        or time.monotonic() - _CALIBRATION["time"] > CALIBRATION_LIFETIME
+    ):
+        query = QueryBuilder()
+        query.append(
+            CalcJobNode,
+            filters={
+                "process_type": PwCalculation.build_process_type(),
+                "attributes.exit_status": 0,
+            },
+            project="attributes.resources",
+            tag="calculation",
+        )
+        query.append(
+            Dict,
+            with_outgoing="calculation",
+            edge_filters={"label": "parameters"},
+            project="attributes.SYSTEM.ecutrho",
+        )
+        query.append(
+            KpointsData,
+            with_outgoing="calculation",
+            edge_filters={"label": "kpoints"},
+            project="attributes.mesh",
+        )
+        query.append(
+            Dict,
+            with_incoming="calculation",
+            edge_filters={"label": "output_parameters"},
+            project=[
+                "attributes.number_of_atoms",
+                "attributes.volume",
+                "attributes.wall_time_seconds",
+            ],
+        )
+        query.order_by({"calculation": {"ctime": "desc"}})
+        query.limit(1000)
+
+        samples = []
+        for resources, ecutrho, mesh, num_atoms, volume, wall_time in query.iterall():
+            num_mpiprocs = resources.get("tot_num_mpiprocs") or (
+                resources.get("num_machines", 1)
+                * resources.get("num_mpiprocs_per_machine", 0)
+            )
+            if not (num_mpiprocs and ecutrho and mesh and wall_time):
+                continue
+            cost = estimate_scf_cost(num_atoms, volume, ecutrho, mesh)
+            samples.append(wall_time * num_mpiprocs / cost)
+
+        # The median is robust against calculations that were slowed down e.g. by a busy machine
+        _CALIBRATION["seconds_per_cost"] = (
+            float(np.median(samples)) if samples else DEFAULT_SECONDS_PER_COST
+        )
+        _CALIBRATION["time"] = time.monotonic()
+    return _CALIBRATION["seconds_per_cost"]
+
+
+def estimate_scf_resources(structure, code, parameters, mesh):
+    """Choose the MPI processes, k-point pools and wall time of an SCF calculation from its estimated cost.
+
+    The smallest number of processes for which the cost per process is below `TARGET_COST_PER_MPIPROC` is chosen:
+    first within a single machine, then on up to `MAX_NUM_MACHINES` full machines (only one with the direct scheduler).
+    The MPI layout only depends on the inputs, so that the hash of the calculation does not change when the
+    calibration does, while the wall time is estimated with the calibrated `get_seconds_per_cost`.
+    The k-points are distributed over as many pools as possible, but never more than the irreducible k-points of the
+    mesh, which are at least the number of k-points divided by the 48 symmetry operations of a cubic lattice.
+
+    :return: tuple of the resources, the wall time in seconds and the number of pools
+    """
+    cost = estimate_scf_cost(
+        len(structure.sites),
+        structure.get_cell_volume(),
+        parameters["SYSTEM"]["ecutrho"],
+        mesh,
+    )
+
+    mpiprocs_per_machine = code.computer.get_default_mpiprocs_per_machine() or 1
+    # The direct scheduler runs the calculation on the computer itself
+    max_num_machines = (
+        1 if code.computer.scheduler_type == "core.direct" else MAX_NUM_MACHINES
+    )
+    candidates = [
+        (1, num_mpiprocs)
+        for num_mpiprocs in range(1, mpiprocs_per_machine + 1)
+        if mpiprocs_per_machine % num_mpiprocs == 0
+    ] + [
+        (num_machines, mpiprocs_per_machine)
+        for num_machines in range(2, max_num_machines + 1)
+    ]
+    for num_machines, num_mpiprocs_per_machine in candidates:
+        num_mpiprocs = num_machines * num_mpiprocs_per_machine
+        if cost / num_mpiprocs <= TARGET_COST_PER_MPIPROC:
+            break
+
+    max_pools = max(int(np.prod(mesh)) // 48, 1)
+    pools = max(
+        pools
+        for pools in range(1, min(num_mpiprocs, max_pools) + 1)
+        if num_mpiprocs % pools == 0
+    )
+
+    walltime = WALLTIME_SAFETY_FACTOR * cost * get_seconds_per_cost() / num_mpiprocs
+    resources = {
+        "num_machines": num_machines,
+        "num_mpiprocs_per_machine": num_mpiprocs_per_machine,
+    }
+    return resources, int(min(max(walltime, MIN_WALLTIME), MAX_WALLTIME)), pools
+
 
 def generate_scf_input_params(structure, code, pseudo_family):
     """Construct a builder for the `PwCalculation` class and populate its inputs.
 
+    The parameters and k-points nodes are shared with all other calculations with the same content, see
+    `get_or_store_node`, and the pseudopotentials are cached per family and kinds, see `get_pseudos`. The resources
+    and wall time are estimated from the size of the calculation, see `estimate_scf_resources`.
+
     :return: `ProcessBuilder` instance for `PwCalculation` with preset inputs
     """
     parameters = {
@@ -27,75 +247,482 @@ def generate_scf_input_params(structure, code, pseudo_family):
             "conv_thr": 1.0e-6,
         },
     }
+    mesh = [2, 2, 2]
 
-    kpoints = KpointsData()
-    kpoints.set_kpoints_mesh([2, 2, 2])
+    def setup_kpoints():
+        kpoints = KpointsData()
+        kpoints.set_kpoints_mesh(mesh)
+        return kpoints
 
     builder = PwCalculation.get_builder()
     builder.code = code
     builder.structure = structure
-    builder.kpoints = kpoints
-    builder.parameters = Dict(dict=parameters)
-    builder.pseudos = pseudo_family.get_pseudos(structure=structure)
-    builder.metadata.options.resources = {"num_machines": 1}
-    builder.metadata.options.max_wallclock_seconds = 30 * 60
+    builder.kpoints = get_or_store_node(KpointsData, {"mesh": mesh}, setup_kpoints)
+    builder.parameters = get_or_store_node(
+        Dict, parameters, lambda: Dict(dict=parameters)
+    )
+    builder.pseudos = get_pseudos(pseudo_family, structure)
+
+    # Scale the resources with the size of the calculation, see `estimate_scf_resources`
+    resources, walltime, pools = estimate_scf_resources(
+        structure, code, parameters, mesh
+    )
+    builder.metadata.options.resources = resources
+    builder.metadata.options.max_wallclock_seconds = walltime
+    if pools > 1:
+        settings = {"cmdline": ["-nk", str(pools)]}
+        builder.settings = get_or_store_node(
+            Dict, settings, lambda: Dict(dict=settings)
+        )
 
     return builder
 
 
+def _query_output_parameters(calculations, project):
+    """Return a query for the `output_parameters` of the calculations, projecting the calculation pk first."""
+    query = QueryBuilder()
+    query.append(
+        CalcJobNode,
+        filters={"id": {"in": [calculation.pk for calculation in calculations]}},
+        project="id",
+        tag="calculation",
+    )
+    query.append(
+        Dict,
+        with_incoming="calculation",
+        edge_filters={"label": "output_parameters"},
+        project=project,
+    )
+    return query
+
+
+def get_output_parameters(calculations):
+    """Return the `output_parameters` node of each calculation, fetched in a single query.
+
+    :param calculations: iterable of calculation nodes
+    :return: dictionary of calculation pk to its `output_parameters` node
+    """
+    query = _query_output_parameters(calculations, "*")
+    return dict(query.all())
+
+
+def get_eos_values(calculations):
+    """Return the volume, energy and energy units of each calculation, projected in a single query.
+
+    Contrary to `get_output_parameters`, only the three attributes are fetched from the database, which is all that
+    is needed to fit the equation of state.
+
+    :param calculations: iterable of calculation nodes
+    :return: dictionary of calculation pk to a `(volume, energy, energy_units)` tuple
+    """
+    query = _query_output_parameters(
+        calculations,
+        ["attributes.volume", "attributes.energy", "attributes.energy_units"],
+    )
+    return {pk: tuple(values) for pk, *values in query.all()}
+
+
+class CachingMixin:
+    """Mixin for work chains that reuse finished calculations with identical inputs instead of running them again.
+
+    Every process submitted with `self.submit` is stored with caching enabled for its process type: if a calculation
+    with the same hash of its inputs already finished successfully, its node and outputs are cloned and the process is
+    not run again. The source of the clone is recorded on the new node, see `node.base.caching.get_cache_source()`.
+    Call `report_cache_hits` at the end of the work chain to report the cache hit rate.
+
+    Put the mixin before `WorkChain` in the bases of the work chain, e.g. `class MyWorkChain(CachingMixin, WorkChain)`.
+    """
+
+    def submit(self, process, inputs=None, **kwargs):
+        """Submit a process with caching enabled for its process type."""
+        with enable_caching(identifier=process.build_process_type()):
+            node = super().submit(process, inputs, **kwargs)
+
+        self.ctx.cache_submitted = self.ctx.get("cache_submitted", 0) + 1
+        if node.base.caching.is_created_from_cache:
+            self.ctx.cache_hits = self.ctx.get("cache_hits", 0) + 1
+            self.report(
+                "Reusing the results of {}<{}> with identical inputs".format(
+                    node.process_label, node.base.caching.get_cache_source()
+                )
+            )
+        return node
+
+    def report_cache_hits(self):
+        """Report how many of the submitted processes were taken from the cache."""
+        submitted = self.ctx.get("cache_submitted", 0)
+        hits = self.ctx.get("cache_hits", 0)
+        if submitted:
+            self.report(
+                "Cache hits: {} of {} submitted processes ({:.0%})".format(
+                    hits, submitted, hits / submitted
+                )
+            )
+
+
 def birch_murnaghan(V, E0, V0, B0, B01):
     """Compute energy by Birch Murnaghan formula."""
     r = (V0 / V) ** (2.0 / 3.0)
     return E0 + 9.0 / 16.0 * B0 * V0 * (r - 1.0) ** 2 * (2.0 + (B01 - 4.0) * (r - 1.0))
 
 
-def fit_birch_murnaghan_params(volumes_, energies_):
-    """Fit Birch Murnaghan parameters."""
+def birch_murnaghan_jacobian(V, E0, V0, B0, B01):
+    """Compute the derivatives of the Birch Murnaghan energy with respect to (E0, V0, B0, B01).
+
+    All arguments are broadcast against each other, the derivatives are stacked along a new last axis.
+    """
+    r = (V0 / V) ** (2.0 / 3.0)
+    u = r - 1.0
+    polynomial = u**2 * (2.0 + (B01 - 4.0) * u)
+    return np.stack(
+        np.broadcast_arrays(
+            np.ones_like(u),
+            9.0
+            / 16.0
+            * B0
+            * (polynomial + 2.0 / 3.0 * r * (4.0 * u + 3.0 * (B01 - 4.0) * u**2)),
+            9.0 / 16.0 * V0 * polynomial,
+            9.0 / 16.0 * B0 * V0 * u**3,
+        ),
+        axis=-1,
+    )
+
+
+def murnaghan(V, E0, V0, B0, B01):
+    """Compute energy by Murnaghan formula."""
+    return (
+        E0
+        + B0 * V / B01 * ((V0 / V) ** B01 / (B01 - 1.0) + 1.0)
+        - V0 * B0 / (B01 - 1.0)
+    )
+
+
+def murnaghan_jacobian(V, E0, V0, B0, B01):
+    """Compute the derivatives of the Murnaghan energy with respect to (E0, V0, B0, B01)."""
+    y = (V0 / V) ** B01
+    return np.stack(
+        np.broadcast_arrays(
+            np.ones_like(y),
+            B0 / (B01 - 1.0) * (V * y / V0 - 1.0),
+            V / B01 * (y / (B01 - 1.0) + 1.0) - V0 / (B01 - 1.0),
+            B0
+            * V
+            * (
+                y * np.log(V0 / V) / (B01 * (B01 - 1.0))
+                - y * (2.0 * B01 - 1.0) / (B01 * (B01 - 1.0)) ** 2
+                - 1.0 / B01**2
+            )
+            + V0 * B0 / (B01 - 1.0) ** 2,
+        ),
+        axis=-1,
+    )
+
+
+def vinet(V, E0, V0, B0, B01):
+    """Compute energy by Vinet formula."""
+    eta = (V / V0) ** (1.0 / 3.0)
+    return E0 + 2.0 * B0 * V0 / (B01 - 1.0) ** 2 * (
+        2.0
+        - (5.0 + 3.0 * B01 * (eta - 1.0) - 3.0 * eta)
+        * np.exp(-3.0 / 2.0 * (B01 - 1.0) * (eta - 1.0))
+    )
+
+
+def vinet_jacobian(V, E0, V0, B0, B01):
+    """Compute the derivatives of the Vinet energy with respect to (E0, V0, B0, B01)."""
+    eta = (V / V0) ** (1.0 / 3.0)
+    a = B01 - 1.0
+    w = eta - 1.0
+    g = np.exp(-3.0 / 2.0 * a * w)
+    F = 2.0 - (2.0 + 3.0 * a * w) * g
+    return np.stack(
+        np.broadcast_arrays(
+            np.ones_like(eta),
+            2.0 * B0 * F / a**2 - 3.0 * B0 * w * g * eta,
+            2.0 * V0 * F / a**2,
+            2.0 * B0 * V0 * (4.5 * w**2 * g / a - 2.0 * F / a**3),
+        ),
+        axis=-1,
+    )
+
+
+# Equations of state that can be fitted, with their Jacobian, all taking the parameters (E0, V0, B0, B01)
+EOS_MODELS = {
+    "birch_murnaghan": (birch_murnaghan, birch_murnaghan_jacobian),
+    "murnaghan": (murnaghan, murnaghan_jacobian),
+    "vinet": (vinet, vinet_jacobian),
+}
+
+
+def guess_eos_params(volumes, energies):
+    """Estimate the parameters (E0, V0, B0, B01) of one or many curves at once from a cubic fit in V^(-2/3).
+
+    The third-order Birch Murnaghan energy is exactly a cubic polynomial in x = V^(-2/3), so the parameters follow in
+    closed form from the minimum of the fitted polynomial. They have the same meaning for all `EOS_MODELS`, so they
+    are a good starting point for each of them.
+
+    :param volumes: array of shape (N, k) with the volumes of N curves, or (k,) for a single curve
+    :param energies: array with the corresponding energies
+    :return: array of shape (N, 4) with (E0, V0, B0, B01) of each curve, or (4,) for a single curve
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    if volumes.ndim == 1:
+        return guess_eos_params(volumes[np.newaxis], energies[np.newaxis])[0]
+
+    # Least squares fit of E = c0 + c1 t + c2 t^2 + c3 t^3 for all curves, through the normal equations, where
+    # t = (x - center) / scale maps the points to [-1, 1] to keep the fit well-conditioned
+    x = volumes ** (-2.0 / 3.0)
+    center = (x.max(axis=-1) + x.min(axis=-1)) / 2.0
+    scale = (x.max(axis=-1) - x.min(axis=-1)) / 2.0
+    t = (x - center[:, np.newaxis]) / scale[:, np.newaxis]
+    vandermonde = t[..., np.newaxis] ** np.arange(4)
+    normal = np.einsum("nki,nkj->nij", vandermonde, vandermonde)
+    rhs = np.einsum("nki,nk->ni", vandermonde, energies)
+    c0, c1, c2, c3 = np.linalg.solve(normal, rhs[..., np.newaxis])[..., 0].T
+
+    # Stationary points of the cubic: c1 + 2 c2 t + 3 c3 t^2 = 0, pick the minimum (second derivative > 0)
+    discriminant = np.sqrt(np.clip(c2**2 - 3.0 * c1 * c3, 0.0, None))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t0 = np.where(
+            np.abs(c3) > 1e-12 * np.abs(c2),
+            (-c2 + discriminant) / (3.0 * c3),
+            -c1 / (2.0 * c2),
+        )
+    V0 = (center + scale * t0) ** (-3.0 / 2.0)
+
+    # Chain rule for the volume derivatives at the minimum, where dE/dt = 0
+    dt_dV = -2.0 / 3.0 * V0 ** (-5.0 / 3.0) / scale
+    d2t_dV2 = 10.0 / 9.0 * V0 ** (-8.0 / 3.0) / scale
+    d2E_dt2 = 2.0 * c2 + 6.0 * c3 * t0
+    d3E_dt3 = 6.0 * c3
+    d2E_dV2 = d2E_dt2 * dt_dV**2
+    d3E_dV3 = d3E_dt3 * dt_dV**3 + 3.0 * d2E_dt2 * dt_dV * d2t_dV2
+
+    E0 = c0 + c1 * t0 + c2 * t0**2 + c3 * t0**3
+    B0 = V0 * d2E_dV2
+    B01 = -1.0 - V0 * d3E_dV3 / d2E_dV2
+
+    return np.stack([E0, V0, B0, B01], axis=-1)
+
+
+def fit_eos_params(volumes_, energies_, model="birch_murnaghan"):
+    """Fit the parameters (E0, V0, B0, B01) of an equation of state.
+
+    :param model: name of the equation of state, one of `EOS_MODELS`
+    """
     from scipy.optimize import curve_fit
 
-    volumes = np.array(volumes_)
-    energies = np.array(energies_)
+    function, jacobian = EOS_MODELS[model]
+    volumes = np.array(volumes_, dtype=float)
+    energies = np.array(energies_, dtype=float)
     params, covariance = curve_fit(
-        birch_murnaghan,
+        function,
         xdata=volumes,
         ydata=energies,
-        p0=(
-            energies.min(),  # E0
-            volumes.mean(),  # V0
-            0.1,  # B0
-            3.0,  # B01
-        ),
+        p0=guess_eos_params(volumes, energies),
+        jac=lambda V, *params: jacobian(V, *params),
         sigma=None,
     )
     return params, covariance
 
 
-def plot_eos(eos_pk):
+def fit_birch_murnaghan_params(volumes_, energies_):
+    """Fit Birch Murnaghan parameters."""
+    return fit_eos_params(volumes_, energies_, model="birch_murnaghan")
+
+
+def fit_eos_batch(
+    volumes, energies, model="birch_murnaghan", max_iterations=20, rtol=1e-10
+):
+    """Fit the parameters (E0, V0, B0, B01) of many equations of state at once.
+
+    The initial parameters come from :func:`guess_eos_params` and are refined with Levenberg-Marquardt
+    steps that are vectorized over all curves; every curve keeps its own damping and stops once converged.
+
+    :param volumes: array of shape (N, k) with the volumes of N curves of k points each
+    :param energies: array of shape (N, k) with the corresponding energies
+    :param model: name of the equation of state, one of `EOS_MODELS`
+    :param max_iterations: maximum number of Levenberg-Marquardt steps
+    :param rtol: relative decrease of the sum of squared residuals below which a curve is converged
+    :return: tuple of an array of shape (N, 4) with (E0, V0, B0, B01) and an array of shape (N, 4, 4) with the
+        covariance of the parameters of each curve (estimated as in ``scipy.optimize.curve_fit``)
     """
-    Plots equation of state taking as input the pk of the ProcessCalculation
-    printed at the beginning of the execution of run_eos_wf
+    volumes = np.atleast_2d(np.asarray(volumes, dtype=float))
+    energies = np.atleast_2d(np.asarray(energies, dtype=float))
+    num_curves, num_points = volumes.shape
+    function, jacobian_function = EOS_MODELS[model]
+
+    def residuals(parameters):
+        return energies - function(volumes, *parameters.T[..., np.newaxis])
+
+    params = guess_eos_params(volumes, energies)
+    cost = np.sum(residuals(params) ** 2, axis=-1)
+    damping = np.full(num_curves, 1e-3)
+    active = np.isfinite(cost)
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        jacobian = jacobian_function(
+            volumes[active], *params[active].T[..., np.newaxis]
+        )
+        hessian = np.einsum("nki,nkj->nij", jacobian, jacobian)
+        gradient = np.einsum("nki,nk->ni", jacobian, residuals(params)[active])
+        diagonal = np.einsum("nii->ni", hessian)
+        step = np.linalg.solve(
+            hessian
+            + damping[active, np.newaxis, np.newaxis]
+            * np.eye(4)
+            * diagonal[:, np.newaxis, :],
+            gradient[..., np.newaxis],
+        )[..., 0]
+
+        trial = params.copy()
+        trial[active] += step
+        trial_cost = np.sum(residuals(trial) ** 2, axis=-1)
+
+        improved = active & (trial_cost < cost)
+        converged = improved & (cost - trial_cost <= rtol * cost)
+        params[improved] = trial[improved]
+        damping[improved] /= 10.0
+        damping[active & ~improved] *= 10.0
+        # A curve that can no longer be improved within the machine precision is also converged
+        converged |= active & ~improved & (damping > 1e10)
+        cost[improved] = trial_cost[improved]
+        active &= ~converged
+
+    jacobian = jacobian_function(volumes, *params.T[..., np.newaxis])
+    variance = cost / max(num_points - 4, 1)
+    covariance = (
+        np.linalg.pinv(np.einsum("nki,nkj->nij", jacobian, jacobian))
+        * variance[:, np.newaxis, np.newaxis]
+    )
+
+    return params, covariance
+
+
+@calcfunction
+def create_eos_array(eos_model, **kwargs):
+    """Create a single column-oriented `ArrayData` node from the `Dict` output parameters of completed calculations.
+
+    The node stores the volumes and energies, sorted by volume, as the arrays `volumes` and `energies`, their units in
+    the `energy_units` attribute and the equation of state in the `eos_model` attribute. With at least four points, the
+    parameters (E0, V0, B0, B01) of the equation of state and their covariance are fitted and, if the fit converges,
+    stored next to them as the `fit_parameters` and `fit_covariance` arrays.
+
+    :param eos_model: `Str` with the name of the equation of state that is fitted, one of `EOS_MODELS`
+    :return: `ArrayData` node with the equation of state results
+    """
+    values = sorted(
+        (result["volume"], result["energy"], result["energy_units"])
+        for result in kwargs.values()
+    )
+    volumes, energies, units = zip(*values)
+
+    eos = ArrayData()
+    eos.set_array("volumes", np.array(volumes, dtype=float))
+    eos.set_array("energies", np.array(energies, dtype=float))
+    eos.base.attributes.set("energy_units", units[-1])
+    eos.base.attributes.set("eos_model", eos_model.value)
+
+    if len(volumes) >= 4:
+        # The volumes and energies are stored even if the fit does not converge
+        try:
+            params, covariance = fit_eos_params(
+                volumes, energies, model=eos_model.value
+            )
+        except (RuntimeError, ValueError):
+            return eos
+        eos.set_array("fit_parameters", params)
+        eos.set_array("fit_covariance", covariance)
+
+    return eos
+
+
+def get_eos_arrays(eos):
+    """Return the volumes, energies and energy units of an equation of state node.
+
+    Both the `ArrayData` nodes of `create_eos_array` and the `Dict` nodes with a list of `(V, E, units)` tuples of
+    `create_eos_dictionary` and `get_eos_data` are supported.
+
+    :return: tuple of the volumes and energies arrays and the energy units
+    """
+    if isinstance(eos, ArrayData):
+        return (
+            eos.get_array("volumes"),
+            eos.get_array("energies"),
+            eos.base.attributes.get("energy_units"),
+        )
+
+    volumes, energies, units = zip(*eos["eos"])
+    return np.array(volumes, dtype=float), np.array(energies, dtype=float), units[-1]
+
+
+def get_eos_plot_data(eos_pk):
+    """Return the data needed to plot the equation of state of a work function or work chain.
+
+    :param eos_pk: pk of the `run_eos_wf` work function or of an equation of state work chain
+    :return: tuple of the volumes, energies, energy units, name of the equation of state and its fitted parameters,
+        or `None` if no fit was stored by `create_eos_array`
+    :raises ValueError: if the process has no equation of state output, e.g. because it failed
     """
-    import pylab as pl
     from aiida.orm import load_node
 
     eos_calc = load_node(eos_pk)
 
-    data = []
-    for V, E, units in eos_calc.outputs.result.dict.eos:
-        data.append((V, E))
+    # Work functions return their result as `result`, the work chains attach it as `eos`
+    if "result" in eos_calc.outputs:
+        eos = eos_calc.outputs.result
+    elif "eos" in eos_calc.outputs:
+        eos = eos_calc.outputs.eos
+    else:
+        raise ValueError(
+            "Process<{}> has no equation of state output, its exit status is {}".format(
+                eos_pk, eos_calc.exit_status
+            )
+        )
+    volumes, energies, units = get_eos_arrays(eos)
+
+    if not isinstance(eos, ArrayData):
+        return volumes, energies, units, "birch_murnaghan", None
 
-    data = np.array(data)
-    params, _covariance = fit_birch_murnaghan_params(data[:, 0], data[:, 1])
+    model = eos.base.attributes.get("eos_model", "birch_murnaghan")
+    if "fit_parameters" in eos.get_arraynames():
+        return volumes, energies, units, model, eos.get_array("fit_parameters")
+    return volumes, energies, units, model, None
 
-    vmin = data[:, 0].min()
-    vmax = data[:, 0].max()
-    vrange = np.linspace(vmin, vmax, 300)
 
-    pl.plot(data[:, 0], data[:, 1], "o")
-    pl.plot(vrange, birch_murnaghan(vrange, *params))
+def draw_eos(axes, volumes, energies, units, model="birch_murnaghan", params=None):
+    """Draw the computed points and the fitted equation of state on a matplotlib `Axes`.
+
+    :param params: fitted parameters of the equation of state, fitted here if `None`. Only the points are drawn if
+        there are less than four of them or the fit does not converge.
+    """
+    if params is None and len(volumes) >= 4:
+        try:
+            params, _covariance = fit_eos_params(volumes, energies, model=model)
+        except (RuntimeError, ValueError):
+            pass
+
+    axes.plot(volumes, energies, "o")
+    if params is not None:
+        vrange = np.linspace(volumes.min(), volumes.max(), 300)
+        axes.plot(vrange, EOS_MODELS[model][0](vrange, *params))
+
+    axes.set_xlabel("Volume (ang^3)")
+    axes.set_ylabel("Energy ({})".format(units))
+
+
+def plot_eos(eos_pk):
+    """
+    Plots equation of state taking as input the pk of the ProcessCalculation
+    printed at the beginning of the execution of run_eos_wf, or the pk of an
+    equation of state work chain
+    """
+    import pylab as pl
 
-    pl.xlabel("Volume (ang^3)")
-    # I take the last value in the list of units assuming units do not change
-    pl.ylabel("Energy ({})".format(units))  # pylint: disable=undefined-loop-variable
-    pl.savefig(f"EOS-{eos_pk}.pdf")
+    figure, axes = pl.subplots()
+    draw_eos(axes, *get_eos_plot_data(eos_pk))
+    figure.savefig(f"EOS-{eos_pk}.pdf")
     pl.show()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Stand-in for `pw.x` that writes the output files of an SCF calculation without computing anything.
+
+It reads the cell and atoms from the input file and writes the standard output and a minimal XML file, with the total
+energy given by a Birch-Murnaghan equation of state, so that `PwCalculation` parses the results as for a real run.
+This is only meant to measure the overhead of the engine and the database, e.g. with ``benchmark_workchains.py``.
+Set it up as a code for `quantumespresso.pw` with e.g.::
+
+    verdi code create core.code.installed --label pw-stub --computer localhost --no-with-mpi \\
+        --default-calc-job-plugin quantumespresso.pw --filepath-executable $PWD/stub_pw.py
+
+The wall time is not written on purpose, so the calculations are not used to calibrate `get_seconds_per_cost`. The
+XML file only has the elements that the parser needs, so the parser logs schema validation errors, which are harmless.
+"""
+import os
+import re
+import sys
+
+BOHR_TO_ANG = 0.529177210903
+HARTREE_TO_EV = 27.211386245988
+
+# Parameters of the equation of state per atom: energy in eV, volume in ang^3 and bulk modulus in eV/ang^3
+E0, V0, B0, B01 = -155.0, 20.5, 0.55, 4.0
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<qes:espresso xmlns:qes="http://www.quantum-espresso.org/ns/qes/qes-1.0"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="http://www.quantum-espresso.org/ns/qes/qes-1.0 http://www.quantum-espresso.org/ns/qes/qes_230310.xsd">
+  <general_info>
+    <xml_format NAME="QEXSD" VERSION="23.03.10">QEXSD_23.03.10</xml_format>
+    <creator NAME="PWSCF" VERSION="7.2">XML file generated by PWSCF</creator>
+  </general_info>
+  <input>
+    <atomic_species ntyp="{ntyp}">{species}</atomic_species>
+    <atomic_structure nat="{nat}" alat="1.0">{structure}</atomic_structure>
+  </input>
+  <output>
+    <convergence_info>
+      <scf_conv>
+        <convergence_achieved>true</convergence_achieved>
+        <n_scf_steps>1</n_scf_steps>
+        <scf_error>0.0</scf_error>
+      </scf_conv>
+    </convergence_info>
+    <algorithmic_info>
+      <real_space_q>false</real_space_q>
+    </algorithmic_info>
+    <atomic_species ntyp="{ntyp}">{species}</atomic_species>
+    <atomic_structure nat="{nat}" alat="1.0">{structure}</atomic_structure>
+    <basis_set>
+      <ecutwfc>15.0</ecutwfc>
+      <ecutrho>100.0</ecutrho>
+      <fft_grid nr1="1" nr2="1" nr3="1"></fft_grid>
+      <fft_smooth nr1="1" nr2="1" nr3="1"></fft_smooth>
+      <fft_box nr1="1" nr2="1" nr3="1"></fft_box>
+      <ngm>1</ngm>
+      <ngms>1</ngms>
+      <npwx>1</npwx>
+      <reciprocal_lattice>
+        <b1>1.0 0.0 0.0</b1>
+        <b2>0.0 1.0 0.0</b2>
+        <b3>0.0 0.0 1.0</b3>
+      </reciprocal_lattice>
+    </basis_set>
+    <total_energy>
+      <etot>{energy}</etot>
+    </total_energy>
+  </output>
+  <status>0</status>
+</qes:espresso>
+"""
+
+STDOUT = """
+     Program PWSCF v.7.2 starts on stub
+
+     lattice parameter (alat)  =       1.0000  a.u.
+     unit-cell volume          =     {volume:16.4f} (a.u.)^3
+     number of atoms/cell      =            {nat}
+     number of atomic types    =            {ntyp}
+     number of Kohn-Sham states=            {nat}
+
+     End of self-consistent calculation
+
+!    total energy              =     {energy:16.8f} Ry
+
+     convergence has been achieved in   1 iterations
+
+     JOB DONE.
+"""
+
+
+def read_input(filename):
+    """Return the species, the cell vectors and the atoms of a `pw.x` input file with cell and positions in ang."""
+    with open(filename, encoding="utf-8") as handle:
+        lines = [line.strip() for line in handle if line.strip()]
+
+    nat = int(re.search(r"nat\s*=\s*(\d+)", "\n".join(lines)).group(1))
+    ntyp = int(re.search(r"ntyp\s*=\s*(\d+)", "\n".join(lines)).group(1))
+    cards = {
+        line.split()[0]: index
+        for index, line in enumerate(lines)
+        if line.split()[0] in ("ATOMIC_SPECIES", "CELL_PARAMETERS", "ATOMIC_POSITIONS")
+    }
+
+    start = cards["ATOMIC_SPECIES"] + 1
+    species = [line.split() for line in lines[start : start + ntyp]]
+    start = cards["CELL_PARAMETERS"] + 1
+    cell = [[float(x) for x in line.split()] for line in lines[start : start + 3]]
+    start = cards["ATOMIC_POSITIONS"] + 1
+    atoms = [
+        (line.split()[0], [float(x) for x in line.split()[1:4]])
+        for line in lines[start : start + nat]
+    ]
+    return species, cell, atoms
+
+
+def get_volume(cell):
+    """Return the volume of a cell."""
+    (a1, a2, a3), (b1, b2, b3), (c1, c2, c3) = cell
+    return abs(
+        a1 * (b2 * c3 - b3 * c2) - a2 * (b1 * c3 - b3 * c1) + a3 * (b1 * c2 - b2 * c1)
+    )
+
+
+def get_energy(volume, nat):
+    """Return the Birch-Murnaghan energy in eV of `nat` atoms in a cell with the given volume in ang^3."""
+    eta = (V0 * nat / volume) ** (2.0 / 3.0)
+    return nat * E0 + 9.0 / 16.0 * B0 * V0 * nat * (eta - 1.0) ** 2 * (
+        6.0 + B01 * (eta - 1.0) - 4.0 * eta
+    )
+
+
+def write_outputs(species, cell, atoms):
+    """Write the XML file of the calculation and print its standard output."""
+    energy = get_energy(get_volume(cell), len(atoms)) / HARTREE_TO_EV
+    xml_species = "".join(
+        '<species name="{}"><mass>{}</mass><pseudo_file>{}</pseudo_file></species>'.format(
+            *specie
+        )
+        for specie in species
+    )
+    xml_atoms = "".join(
+        '<atom name="{}" index="{}">{} {} {}</atom>'.format(
+            name, index, *(x / BOHR_TO_ANG for x in position)
+        )
+        for index, (name, position) in enumerate(atoms, 1)
+    )
+    xml_cell = "".join(
+        "<a{0}>{1} {2} {3}</a{0}>".format(i, *(x / BOHR_TO_ANG for x in vector))
+        for i, vector in enumerate(cell, 1)
+    )
+    structure = "<atomic_positions>{}</atomic_positions><cell>{}</cell>".format(
+        xml_atoms, xml_cell
+    )
+
+    os.makedirs(os.path.join("out", "aiida.save"), exist_ok=True)
+    with open(
+        os.path.join("out", "aiida.save", "data-file-schema.xml"), "w", encoding="utf-8"
+    ) as handle:
+        handle.write(
+            XML.format(
+                ntyp=len(species),
+                species=xml_species,
+                nat=len(atoms),
+                structure=structure,
+                energy=energy,
+            )
+        )
+    print(
+        STDOUT.format(
+            nat=len(atoms),
+            ntyp=len(species),
+            volume=get_volume(cell) / BOHR_TO_ANG**3,
+            energy=2 * energy,
+        )
+    )
+
+
+if __name__ == "__main__":
+    write_outputs(*read_input(sys.argv[sys.argv.index("-in") + 1]))